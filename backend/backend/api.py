@@ -1,14 +1,20 @@
 from .enums import *
 from .scripts import *
 
+from .renderers import ORJSONRenderer, rows_to_jsonl, rows_to_parquet
+from .schemas import EvaluationRow, SheetOut
+
+from django.conf import settings
+from django.http import HttpResponse
 from ninja import NinjaAPI
-import json
-import pandas as pd
+from ninja.errors import HttpError
+from typing import Optional
+import time
 
-api = NinjaAPI()
+api = NinjaAPI(renderer=ORJSONRenderer())
 
-@api.get("/test")
-def test(request, llm: LLMEnum, judge: LLMEnum, copywriter: LLMEnum, category: int, google_search: bool = True, lang: LangEnum = LangEnum.ENGLISH, number: int = 4, version: int = 2):
+@api.get("/test", response=list[EvaluationRow])
+def test(request, llm: LLMEnum, judge: LLMEnum, copywriter: LLMEnum, category: int, google_search: bool = True, stored_context: bool = False, lang: LangEnum = LangEnum.ENGLISH, number: int = 4, version: int = 2, cascade: Optional[LLMEnum] = None, adaptive_search: bool = False, export: Optional[ExportEnum] = None):
     """
     **Perform testing of responses using Large Language Models (LLMs) for generating spec sheets.**
 
@@ -19,41 +25,32 @@ def test(request, llm: LLMEnum, judge: LLMEnum, copywriter: LLMEnum, category: i
     - `copywriter` (LLMEnum): The LLM used to generate product descriptions.
     - `category` (int): The category ID of the products to be tested.
     - `google_search` (bool, optional): Whether to use Google search to gather additional context for the product queries. Defaults to True.
+    - `stored_context` (bool, optional): Whether to use the contexts precomputed with the `prewarm_contexts` command instead of a live Google search. Defaults to False.
     - `lang` (LangEnum, optional): The language for the copywriter model. Defaults to LangEnum.ENGLISH.
     - `number` (int, optional): The prompt number for the "Maker" LLM. Defaults to 4.
     - `version` (int, optional): The prompt version for the "Maker" LLM. Defaults to 2.
+    - `cascade` (LLMEnum, optional): A cheaper LLM that generates the spec sheets first. The product is escalated to `llm` only when the spec sheet is not valid JSON, leaves attributes of the category empty, or scores under `settings.CASCADE_SCORE_THRESHOLD`. Defaults to None.
+    - `adaptive_search` (bool, optional): Whether to first ask the Maker without context, searching Google only when its answer misses attributes, contains placeholder values or has a self-reported confidence under `settings.ADAPTIVE_CONFIDENCE_THRESHOLD`. Products answered without search are reported with the `not_needed` search outcome. Defaults to False.
+    - `export` (ExportEnum, optional): Return the rows as a downloadable JSONL or Parquet file instead. Parquet requires `pyarrow`. Defaults to None.
 
     **Returns:**
-    - `dict`: A dictionary containing the generated spec sheets, ground truth data, similarity scores, and LLM evaluations, serialized as JSON.
+    - `list[EvaluationRow]`: The generated spec sheet, ground truth data, similarity score, LLM evaluation, search outcome, cascade tier and latency of each product.
+      Each product gets `settings.PRODUCT_TIME_BUDGET` seconds and products left after `settings.REQUEST_TIME_BUDGET` seconds are skipped.
     """
-    model = get_model(llm)
-    judge_model = get_model(judge)
-    copywriter_model = get_model(copywriter)
-    
-    model.start_chat(get_prompt("Maker",category, number, version))
-    judge_model.start_chat(get_prompt("Judge",category, 1, 1))
-    copywriter_model.start_chat(get_prompt("Copywriter",category, 1, 1, lang.value))
-
-    df = pd.DataFrame(columns=["Spec Sheet", "Ground Truth", "Similarity Score", "LLM Evaluation"])
-    for product in get_ground_truth(category):
-        if google_search:
-            prompt = search_google(product[0], model)
-        else:
-            prompt = product[0]
-        response = model.send_message(prompt)
+    if export == ExportEnum.PARQUET:
         try:
-            raw_data = process_json(response)
-            data = json.loads(raw_data)
-            data['description'] = copywriter_model.send_message(raw_data)
-            df.loc[-1] = evaluate(data,product[1], judge_model)
-            df.index = df.index + 1
-            df = df.sort_index()
-
-        except json.JSONDecodeError:
-            df.loc[-1] = [response,product[1].to_json(),{"veredict":None,"score":None},{"veredict":None,"reasoning":None}]
-            df.index = df.index + 1
-            df = df.sort_index()
-    return json.loads(df.to_json())
+            import pyarrow
+        except ImportError:
+            raise HttpError(501, "Parquet export requires pyarrow to be installed.")
+    rows = list(run_test(llm, judge, copywriter, category, google_search, stored_context, lang.value, number, version, cascade, adaptive_search))
+    if export == ExportEnum.JSONL:
+        response = HttpResponse(rows_to_jsonl(rows), content_type="application/x-ndjson")
+    elif export == ExportEnum.PARQUET:
+        response = HttpResponse(rows_to_parquet(rows), content_type="application/vnd.apache.parquet")
+    else:
+        return rows
+    response["Content-Disposition"] = f'attachment; filename="test-{category}-{llm.value}-v{version}.{export.value}"'
+    return response
 
 @api.get("/categories")
 def categories(request):
@@ -86,8 +83,8 @@ def prompts(request, role: RoleEnum):
     """
     return get_prompt_list(role)
 
-@api.post("/get_sheets")
-def get_sheets(request, products: list[str], llm: LLMEnum, copywriter: LLMEnum, category: int, google_search: bool = True, number: int = 4, version: int = 2):
+@api.post("/get_sheets", response=list[SheetOut])
+def get_sheets(request, products: list[str], llm: LLMEnum, copywriter: LLMEnum, category: int, google_search: bool = True, stored_context: bool = False, number: int = 4, version: int = 2, cascade: Optional[LLMEnum] = None, adaptive_search: bool = False):
     """
     **Generates spec sheets for the given list of products using Large Language Models (LLMs).**
 
@@ -98,12 +95,16 @@ def get_sheets(request, products: list[str], llm: LLMEnum, copywriter: LLMEnum,
     - `copywriter` (LLMEnum): The LLM to use for generating copywriting responses.
     - `category` (int): The category ID for the products.
     - `google_search` (bool, optional): Whether to perform Google search to gather context for product queries. Defaults to True.
+    - `stored_context` (bool, optional): Whether to use the contexts precomputed with the `prewarm_contexts` command instead of a live Google search. Defaults to False.
     - `number` (int, optional): The number of the prompt for the Maker LLM. Defaults to 4.
     - `version` (int, optional): The version of the prompt for the Maker LLM. Defaults to 2.
+    - `cascade` (LLMEnum, optional): A cheaper LLM that generates the spec sheets first. The product is escalated to `llm` only when the spec sheet is not valid JSON or leaves attributes of the category empty. Defaults to None.
+    - `adaptive_search` (bool, optional): Whether to first ask the Maker without context, searching Google only when its answer misses attributes, contains placeholder values or has a self-reported confidence under `settings.ADAPTIVE_CONFIDENCE_THRESHOLD`. Products answered without search are reported with the `not_needed` search outcome. Defaults to False.
 
     **Returns:**
-    - `list`: A list of dictionaries representing the generated spec sheets for the products.
-        Each dictionary contains information about the product, including its spec sheet and description.
+    - `list[SheetOut]`: The generated spec sheet of each product, including its description, or the raw response of the Maker if it was not valid JSON, along with the search outcome, cascade tier and latency.
+        Each product gets `settings.PRODUCT_TIME_BUDGET` seconds and products left after `settings.REQUEST_TIME_BUDGET` seconds are skipped.
+        Without cascade nor adaptive search, a Maker that supports batches (`local`) gets every product at once, with their contexts gathered concurrently and each product's budget starting with its context lookup, and each product reports the latency of the whole batch.
     """
     res = []
     model = get_model(llm)
@@ -111,17 +112,34 @@ def get_sheets(request, products: list[str], llm: LLMEnum, copywriter: LLMEnum,
 
     model.start_chat(get_prompt("Maker",category, number, version))
     copywriter_model.start_chat(get_prompt("Copywriter",category, 1, 1))
+    cheap_model = None
+    if cascade:
+        cheap_model = get_model(cascade)
+        cheap_model.start_chat(get_prompt("Maker",category, number, version))
+    request_deadline = Deadline(settings.REQUEST_TIME_BUDGET)
+    if cheap_model is None and not adaptive_search and hasattr(model, "send_batch"):
+        start = time.monotonic()
+        results = generate_sheets_batch(products, model, copywriter_model, llm, google_search, stored_context, request_deadline)
+        latency = time.monotonic() - start
+        for product, (response, data, outcome) in zip(products, results):
+            if outcome == SearchEnum.SKIPPED:
+                res.append(SheetOut(product=product, search=outcome))
+            elif data is None:
+                res.append(SheetOut(product=product, raw=response, search=outcome, tier=TierEnum.SINGLE, latency=latency))
+            else:
+                res.append(SheetOut(product=product, sheet=data, search=outcome, tier=TierEnum.SINGLE, latency=latency))
+        return res
+    attributes = get_category_attributes(category)
     for product in products:
-        if google_search:
-            prompt = search_google(product, model)
+        if request_deadline.expired():
+            res.append(SheetOut(product=product, search=SearchEnum.SKIPPED))
+            continue
+        start = time.monotonic()
+        deadline = Deadline(settings.PRODUCT_TIME_BUDGET, request_deadline)
+        response, data, outcome, tier = generate_sheet(product, model, copywriter_model, llm, google_search, stored_context, deadline, cheap_model, attributes, adaptive_search=adaptive_search)
+        latency = time.monotonic() - start
+        if data is None:
+            res.append(SheetOut(product=product, raw=response, search=outcome, tier=tier, latency=latency))
         else:
-            prompt = product
-        response = model.send_message(prompt)
-        try:
-            raw_data = process_json(response)
-            data = json.loads(raw_data)
-            data['description'] = copywriter_model.send_message(raw_data)
-            res.append(data)
-        except json.JSONDecodeError:
-            res.append(response)
+            res.append(SheetOut(product=product, sheet=data, search=outcome, tier=tier, latency=latency))
     return res
@@ -3,6 +3,7 @@ from enum import Enum
 class LLMEnum(str, Enum):
     GEMINI = "gemini"
     CHATGPT = "gpt"
+    LOCAL = "local"
 
 class RoleEnum(str, Enum):
     MAKER = "Maker"
@@ -11,4 +12,23 @@ class RoleEnum(str, Enum):
 
 class LangEnum(str, Enum):
     ENGLISH = "en"
-    ESPAÑOL = "es"
\ No newline at end of file
+    ESPAÑOL = "es"
+
+class SearchEnum(str, Enum):
+    CONTEXT = "context"
+    PARTIAL = "partial"
+    STORED = "stored"
+    NOT_NEEDED = "not_needed"
+    NO_CONTEXT = "no_context"
+    TIMEOUT = "timeout"
+    DISABLED = "disabled"
+    SKIPPED = "skipped"
+
+class ExportEnum(str, Enum):
+    JSONL = "jsonl"
+    PARQUET = "parquet"
+
+class TierEnum(str, Enum):
+    SINGLE = "single"
+    CHEAP = "cheap"
+    ESCALATED = "escalated"
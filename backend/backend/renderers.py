@@ -0,0 +1,96 @@
+from ninja.renderers import JSONRenderer
+from ninja.responses import NinjaJSONEncoder
+import io, json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    This class renders API responses with orjson, falling back to the default JSON renderer if it is not installed.
+    """
+    def render(self, request, data, *, response_status):
+        """
+        **Serializes the data of a response.**
+
+        **Args:**
+        - `request`: The request object.
+        - `data`: The data to serialize.
+        - `response_status` (int): The status code of the response.
+
+        **Returns:**
+        - `bytes`: The serialized data.
+        """
+        if orjson is None:
+            return super().render(request, data, response_status=response_status)
+        return orjson.dumps(data, default=NinjaJSONEncoder().default, option=orjson.OPT_NON_STR_KEYS)
+
+def dumps(data):
+    """
+    **Serializes data to a JSON string using orjson when it is installed.**
+
+    **Args:**
+    - `data`: The data to serialize.
+
+    **Returns:**
+    - `str`: The serialized data.
+    """
+    if orjson is None:
+        return json.dumps(data, cls=NinjaJSONEncoder, ensure_ascii=False)
+    return orjson.dumps(data, default=NinjaJSONEncoder().default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+def rows_to_jsonl(rows):
+    """
+    **Serializes evaluation rows as JSON Lines.**
+
+    **Args:**
+    - `rows` (list[EvaluationRow]): The evaluation rows.
+
+    **Returns:**
+    - `str`: One JSON object per row.
+    """
+    return "".join(dumps(row.model_dump(mode="json")) + "\n" for row in rows)
+
+def rows_to_parquet(rows):
+    """
+    **Serializes evaluation rows as a Parquet file, with the nested fields as JSON strings.**
+
+    Requires `pyarrow`.
+
+    **Args:**
+    - `rows` (list[EvaluationRow]): The evaluation rows.
+
+    **Returns:**
+    - `bytes`: The Parquet file.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # An explicit schema keeps the column types when every value of a column is None
+    schema = pa.schema([
+        ("spec_sheet", pa.string()),
+        ("ground_truth", pa.string()),
+        ("similarity_veredict", pa.string()),
+        ("similarity_score", pa.float64()),
+        ("llm_veredict", pa.string()),
+        ("llm_evaluation", pa.string()),
+        ("search", pa.string()),
+        ("tier", pa.string()),
+        ("latency", pa.float64()),
+    ])
+    table = pa.Table.from_pylist([{
+        "spec_sheet": dumps(row.spec_sheet),
+        "ground_truth": dumps(row.ground_truth),
+        "similarity_veredict": row.similarity_score.veredict,
+        "similarity_score": row.similarity_score.score,
+        "llm_veredict": None if row.llm_evaluation.veredict is None else str(row.llm_evaluation.veredict),
+        "llm_evaluation": dumps(row.llm_evaluation.model_dump(mode="json")),
+        "search": row.search.value,
+        "tier": None if row.tier is None else row.tier.value,
+        "latency": row.latency,
+    } for row in rows], schema=schema)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    return buffer.getvalue()
@@ -0,0 +1,69 @@
+from ninja import Schema
+from pydantic import BaseModel, ConfigDict
+from typing import Any, Optional, Union
+from .enums import SearchEnum, TierEnum
+
+class SimilarityScore(Schema):
+    """
+    Represents the fuzzy similarity between a spec sheet and its ground truth.
+
+    **Attributes:**
+    - `veredict` (str): Either "Correct", "Inconsistencies found" or "Incorrect", or `None` if the spec sheet could not be parsed.
+    - `score` (float): The average fuzzy ratio of the attributes, from 0 to 100.
+    """
+    veredict: Optional[str] = None
+    score: Optional[float] = None
+
+class LLMEvaluation(BaseModel):
+    """
+    Represents the evaluation of a spec sheet by the "Judge" LLM.
+
+    **Attributes:**
+    - `veredict` (str): The verdict of the Judge, or `None` if it did not answer with JSON.
+    - `reasoning`: The reasoning of the Judge, or its raw answer.
+
+    Any other key returned by the Judge is kept, which is why this is a plain pydantic model rather than a Ninja schema.
+    """
+    model_config = ConfigDict(extra="allow")
+    veredict: Optional[Any] = None
+    reasoning: Optional[Any] = None
+
+class EvaluationRow(Schema):
+    """
+    Represents the evaluation of a ground truth product.
+
+    **Attributes:**
+    - `spec_sheet`: The generated spec sheet, the raw response of the Maker if it was not valid JSON, or `None` if the product was skipped.
+    - `ground_truth` (dict): The ground truth attributes of the product.
+    - `similarity_score` (SimilarityScore): The fuzzy similarity with the ground truth.
+    - `llm_evaluation` (LLMEvaluation): The evaluation of the Judge.
+    - `search` (SearchEnum): The outcome of the search for context.
+    - `tier` (TierEnum): Which model of the cascade generated the spec sheet, or `None` if the product was skipped.
+    - `latency` (float): The seconds spent generating the spec sheet and its description, or `None` if the product was skipped.
+    """
+    spec_sheet: Union[dict, str, None] = None
+    ground_truth: dict
+    similarity_score: SimilarityScore = SimilarityScore()
+    llm_evaluation: LLMEvaluation = LLMEvaluation()
+    search: SearchEnum
+    tier: Optional[TierEnum] = None
+    latency: Optional[float] = None
+
+class SheetOut(Schema):
+    """
+    Represents the spec sheet generated for a product.
+
+    **Attributes:**
+    - `product` (str): The product query.
+    - `sheet` (dict): The spec sheet with its description, or `None` if the Maker did not answer with valid JSON.
+    - `raw` (str): The raw response of the Maker when it is not valid JSON.
+    - `search` (SearchEnum): The outcome of the search for context.
+    - `tier` (TierEnum): Which model of the cascade generated the spec sheet, or `None` if the product was skipped.
+    - `latency` (float): The seconds spent generating the spec sheet and its description, or `None` if the product was skipped.
+    """
+    product: str
+    sheet: Optional[dict] = None
+    raw: Optional[str] = None
+    search: SearchEnum
+    tier: Optional[TierEnum] = None
+    latency: Optional[float] = None
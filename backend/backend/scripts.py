@@ -1,11 +1,13 @@
 from django.conf import settings
-from .enums import LLMEnum
-from specgenie.models import Category, PromptRole, PromptLang, Prompt, GroundTruthProduct
-import google.generativeai as genai
-from openai import OpenAI
-from thefuzz import fuzz
-import json, requests, time, tiktoken
-from bs4 import BeautifulSoup
+from .enums import LLMEnum, SearchEnum, TierEnum
+from .schemas import EvaluationRow
+from specgenie.models import Category, PromptRole, PromptLang, Prompt, GroundTruthAttribute, GroundTruthProduct, SearchContext, FetchedPage, UselessPage
+import codecs, hashlib, json, re, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+# Provider SDKs, requests, bs4, thefuzz and tiktoken are slow to import, so they are
+# imported where they are used: management commands and workers only pay for what they need.
 
 def get_category_list():
   """
@@ -75,6 +77,18 @@ def get_ground_truth(category):
     res.append((f"{product.brand} {product.part_number}",product))
   return res
 
+def get_category_attributes(category):
+  """
+  **Retrieves the names of the ground truth attributes of a category.**
+
+  **Args:**
+  - `category`: The ID of the category.
+
+  **Returns:**
+  - `list`: The names of the attributes.
+  """
+  return list(GroundTruthAttribute.objects.filter(category_id=category).values_list("name", flat=True))
+
 def process_json(data):
   """
   **Processes a LLM's response to ensure proper JSON formatting.**
@@ -95,7 +109,176 @@ def process_json(data):
     pass
   return data
 
-class GeminiAPI:
+class DeadlineExceeded(Exception):
+  """
+  Raised when a time budget runs out, carrying whatever text was gathered until then.
+  """
+  def __init__(self, text=""):
+    super().__init__("The time budget ran out.")
+    self.text = text
+
+class Deadline:
+  """
+  This class tracks a time budget, optionally nested inside a larger one.
+  """
+  def __init__(self, seconds=None, parent=None):
+    """
+    **Initializes a new instance of the Deadline class.**
+
+    **Args:**
+    - `seconds` (float, optional): The budget in seconds. Defaults to None, meaning no limit other than the parent's.
+    - `parent` (Deadline, optional): The larger budget this one is part of.
+    """
+    self.end = None if seconds is None else time.monotonic() + seconds
+    self.parent = parent
+  def remaining(self):
+    """
+    **Returns the number of seconds left, which is infinite if there is no limit.**
+    """
+    remaining = float("inf") if self.end is None else self.end - time.monotonic()
+    if self.parent is not None:
+      remaining = min(remaining, self.parent.remaining())
+    return remaining
+  def expired(self):
+    """
+    **Returns whether the budget has run out.**
+    """
+    return self.remaining() <= 0
+  def timeout(self, default):
+    """
+    **Returns the timeout for a network call, bounded by the time left but never under a second.**
+
+    **Args:**
+    - `default` (float): The timeout to use when there is enough time left.
+    """
+    return max(min(default, self.remaining()), 1)
+
+class RateLimiter:
+  """
+  This class enforces a tokens per minute limit shared by every client of the same provider.
+  """
+  def __init__(self, token_limit_per_min, state=None, lock=None):
+    """
+    **Initializes a new instance of the RateLimiter class.**
+
+    **Args:**
+    - `token_limit_per_min` (int): The maximum number of tokens per minute.
+    - `state` (dict, optional): The dictionary holding the current window. Pass a `multiprocessing.Manager().dict()` to share the limit across processes.
+    - `lock` (optional): The lock guarding the state. Pass a `multiprocessing.Manager().Lock()` to share the limit across processes.
+    """
+    self.token_limit_per_min = token_limit_per_min
+    self.state = state if state is not None else {}
+    self.lock = lock if lock is not None else threading.Lock()
+  def acquire(self, tokens, deadline=None):
+    """
+    **Accounts for tokens about to be used, waiting for the next minute if the limit would be exceeded.**
+
+    **Args:**
+    - `tokens` (int): The number of tokens about to be used.
+    - `deadline` (Deadline, optional): The time budget of the call. Defaults to None.
+
+    **Raises:**
+    - `DeadlineExceeded`: If the budget would run out before the next minute.
+    """
+    deadline = deadline or Deadline()
+    while True:
+      with self.lock:
+        current_time = time.time()
+        window_start = self.state.get("window_start", current_time)
+        used = self.state.get("used", 0)
+        if current_time - window_start >= 60:
+          window_start, used = current_time, 0
+        if not used or used + tokens <= self.token_limit_per_min:
+          self.state["window_start"] = window_start
+          self.state["used"] = used + tokens
+          return
+        wait_time = 60 - (current_time - window_start)
+      # Wait without the lock, so that other clients can use the window if it frees up
+      if wait_time >= deadline.remaining():
+        raise DeadlineExceeded()
+      time.sleep(wait_time)
+  def record(self, tokens):
+    """
+    **Accounts for tokens that were already used, such as those of an answer, without waiting.**
+
+    **Args:**
+    - `tokens` (int): The number of tokens used.
+    """
+    with self.lock:
+      current_time = time.time()
+      if current_time - self.state.get("window_start", current_time) >= 60:
+        self.state["window_start"], self.state["used"] = current_time, 0
+      self.state.setdefault("window_start", current_time)
+      self.state["used"] = self.state.get("used", 0) + tokens
+
+RATE_LIMITERS = {}
+# Shared (state, lock) pairs per provider, set by worker processes that share their limits
+RATE_LIMIT_STATES = {}
+
+def get_rate_limiter(llm, token_limit_per_min):
+  """
+  **Returns the rate limiter shared by every client of a provider.**
+
+  **Args:**
+  - `llm` (LLMEnum): The enum of the provider.
+  - `token_limit_per_min` (int): The limit used if the rate limiter does not exist yet.
+
+  **Returns:**
+  - `RateLimiter`: The rate limiter of the provider.
+  """
+  if llm not in RATE_LIMITERS:
+    RATE_LIMITERS[llm] = RateLimiter(token_limit_per_min, *RATE_LIMIT_STATES.get(llm, (None, None)))
+  return RATE_LIMITERS[llm]
+
+class ChatHistory:
+  """
+  This class keeps the chat history of an LLM client as compact records with cached token counts, trimmed in place to a token window.
+
+  Each record is a dictionary with the `role`, `content` and `tokens` keys. The first `pinned` records hold the starting prompt and are never trimmed.
+  The `tokens` attribute holds the number of tokens of all the records.
+  """
+  def init_history(self, max_tokens):
+    """
+    **Initializes an empty history.**
+
+    **Args:**
+    - `max_tokens` (int): The size of the token window.
+    """
+    self.history = []
+    self.pinned = 0
+    self.max_tokens = max_tokens
+    # The number of tokens in the history, kept up to date instead of summed on every check
+    self.tokens = 0
+  def add_record(self, role, content, tokens):
+    """
+    **Appends a message to the history.**
+
+    **Args:**
+    - `role` (str): The role of the message, as the provider names it.
+    - `content` (str): The text of the message.
+    - `tokens` (int): The number of tokens of the message.
+    """
+    self.history.append({"role": role, "content": content, "tokens": tokens})
+    self.tokens += tokens
+  def trim_history(self, tokens=0):
+    """
+    **Drops the oldest exchanges until a message of the given size fits in the token window, always keeping the starting prompt.**
+
+    **Args:**
+    - `tokens` (int, optional): The number of tokens of the message about to be sent. Defaults to 0.
+    """
+    while len(self.history) > self.pinned and self.tokens + tokens >= self.max_tokens:
+      # Exchanges are a message and its answer
+      self.tokens -= sum(record["tokens"] for record in self.history[self.pinned:self.pinned+2])
+      del self.history[self.pinned:self.pinned+2]
+  def clear_history(self):
+    """
+    **Clears the chat history, keeping the starting prompt. No request is made.**
+    """
+    del self.history[self.pinned:]
+    self.tokens = sum(record["tokens"] for record in self.history)
+
+class GeminiAPI(ChatHistory):
   """
   This class encapsulates functionalities related to interacting with the Gemini API.
   """
@@ -106,25 +289,28 @@ class GeminiAPI:
     **Args:**
     - `gmodel` (str, optional): The name of the GPT model to use. Defaults to 'gemini-pro'.
     """
+    import google.generativeai as genai
     genai.configure(api_key=settings.API_KEY_GEMINI)
     self.model = genai.GenerativeModel(gmodel)
-    self.tokens = 0
-    self.max_tokens = 20000
+    self.init_history(20000)
     self.token_limit_per_min = 30000
-    self.tokens_used_this_minute = 0
-    self.last_request_time = time.time()
+    self.rate_limiter = get_rate_limiter(LLMEnum.GEMINI, self.token_limit_per_min)
   def start_chat(self,prompt):
     """
     Starts a new chat session with the Gemini API.
 
     Returns:
-      A reference to the chat object for further interactions.
+      The response text to the starting prompt, which is kept in the history along with it.
     """
     for attempt in range(settings.ATTEMPTS_PER_MESSAGE):
       try:
-        self.chat = self.model.start_chat(history=[])
-        self.response = self.chat.send_message(prompt)
-        self.tokens += self.count_tokens(prompt)
+        self.pinned = 0
+        self.clear_history()
+        self.response = self.model.generate_content([{"role": "user", "parts": [prompt]}])
+        usage = self.response.usage_metadata
+        self.add_record("user", prompt, usage.prompt_token_count)
+        self.add_record("model", self.response.text, usage.candidates_token_count)
+        self.pinned = len(self.history)
         return self.response.text
       except Exception as e:
         if attempt < settings.ATTEMPTS_PER_MESSAGE - 1:
@@ -132,54 +318,59 @@ class GeminiAPI:
           time.sleep(wait_time)
         else:
           return f"An error occurred while communicating with Gemini.\nError: {e}"
-  def send_message(self, message):
+  def send_message(self, message, deadline=None):
     """
     **Sends a message in the current chat session with the Gemini API.**
 
+    The chat is rebuilt from the local history, trimmed to make room for the message.
+
     **Args:**
     - `message` (str): The message to send.
+    - `deadline` (Deadline, optional): The time budget of the call, retries included. Defaults to None.
 
     **Returns:**
     - `str`: The response text from the API.
     """
+    deadline = deadline or Deadline()
+    try:
+      tokens = self.count_tokens(message, deadline)
+      # Once, so that retries do not count the message again
+      self.rate_limiter.acquire(tokens, deadline)
+    except Exception as e:
+      return f"An error occurred while communicating with Gemini.\nError: {e}"
     for attempt in range(settings.ATTEMPTS_PER_MESSAGE):
       try:
-        # Check if tokens per minute limit is exceeded
-        current_time = time.time()
-        if self.tokens_used_this_minute > self.token_limit_per_min:
-          time_to_wait = 60 - (current_time - self.last_request_time)
-          time.sleep(time_to_wait)
-          self.tokens_used_this_minute = 0
-        self.last_request_time = time.time()
-        self.response = self.chat.send_message(message)
-        self.tokens += self.count_tokens(message)
+        self.trim_history(tokens)
+        chat = self.model.start_chat(history=[{"role": record["role"], "parts": [record["content"]]} for record in self.history])
+        self.response = chat.send_message(message, request_options={"timeout": deadline.timeout(settings.LLM_TIMEOUT)})
+        usage = self.response.usage_metadata
+        # The prompt count covers the whole history, the message is what it adds
+        self.add_record("user", message, max(usage.prompt_token_count - self.tokens, tokens))
+        self.add_record("model", self.response.text, usage.candidates_token_count)
+        self.rate_limiter.record(usage.candidates_token_count)
         return self.response.text
       except Exception as e:
-        if attempt < settings.ATTEMPTS_PER_MESSAGE - 1:
+        if attempt < settings.ATTEMPTS_PER_MESSAGE - 1 and deadline.remaining() > settings.WAIT_TIME * 2 ** attempt:
           wait_time = settings.WAIT_TIME * 2 ** attempt
           time.sleep(wait_time)
         else:
           pass
           return f"An error occurred while communicating with Gemini.\nError: {e}"
-  def count_tokens(self, prompt):
+  def count_tokens(self, prompt, deadline=None):
      """
     **Counts the number of tokens in a prompt.**
 
     **Args:**
     - `prompt` (str): The prompt to count tokens for.
+    - `deadline` (Deadline, optional): The time budget of the call. Defaults to None.
 
     **Returns:**
     - `int`: The number of tokens in the prompt.
     """
-     return self.model.count_tokens(prompt).total_tokens
-  def clear_history(self):
-    """
-    **Clears the chat history and token count.**
-    """
-    self.tokens = 0
-    self.start_chat(self.chat.history[0].parts[0].text)
+     deadline = deadline or Deadline()
+     return self.model.count_tokens(prompt, request_options={"timeout": deadline.timeout(settings.LLM_TIMEOUT)}).total_tokens
   
-class ChatGPTAPI:
+class ChatGPTAPI(ChatHistory):
     """
     This class encapsulates functionalities related to interacting with the ChatGPT API.
     """
@@ -190,14 +381,12 @@ class ChatGPTAPI:
         Args:
         - gmodel (str, optional): The name of the GPT model to use. Defaults to 'gpt-4o'.
         """
+        from openai import OpenAI
         self.client = OpenAI(api_key=settings.API_KEY_OPENAI)
         self.model = gmodel
-        self.messages = []
-        self.tokens = 0
-        self.max_tokens = 20000
+        self.init_history(20000)
         self.token_limit_per_min = 30000
-        self.tokens_used_this_minute = 0
-        self.last_request_time = time.time()
+        self.rate_limiter = get_rate_limiter(LLMEnum.CHATGPT, self.token_limit_per_min)
 
     def start_chat(self, prompt):
         """
@@ -206,85 +395,243 @@ class ChatGPTAPI:
         Args:
         - prompt (str): The initial prompt to start the chat session.
         """
-        self.messages.append({"role": "system", "content": prompt})
-        self.tokens += self.count_tokens(prompt)
+        self.add_record("system", prompt, self.count_tokens(prompt))
+        self.pinned = len(self.history)
 
-    def send_message(self, message):
+    def send_message(self, message, deadline=None):
         """
         Sends a message to the ChatGPT API and retrieves the response.
+        The history sent along is trimmed to make room for the message.
         
         Args:
         - message (str): The message to send to the API.
+        - deadline (Deadline, optional): The time budget of the call. Defaults to None.
         
         Returns:
         - str: The response message from the API.
         """
+        deadline = deadline or Deadline()
         try:
-            self.messages.append({"role": "user", "content": message})
+            tokens = self.count_tokens(message)
+            self.rate_limiter.acquire(tokens, deadline)
+            self.trim_history(tokens)
+            messages = [{"role": record["role"], "content": record["content"]} for record in self.history]
+            messages.append({"role": "user", "content": message})
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=self.messages
+                messages=messages,
+                timeout=deadline.timeout(settings.LLM_TIMEOUT)
             )
-            self.messages.append(response.choices[0].message)
-            self.tokens += self.count_tokens(message)
-            self.tokens_used_this_minute += self.count_tokens(message) + self.count_tokens(response.choices[0].message.content)
-            
-            # Check if tokens per minute limit is exceeded
-            current_time = time.time()
-            if self.tokens_used_this_minute > self.token_limit_per_min:
-                time_to_wait = 60 - (current_time - self.last_request_time)
-                time.sleep(time_to_wait)
-                self.tokens_used_this_minute = 0
-            self.last_request_time = time.time()
-                
-            return response.choices[0].message.content
+            content = response.choices[0].message.content
+            if response.usage is not None:
+                # The prompt count covers the whole history, the message is what it adds
+                tokens = max(response.usage.prompt_tokens - self.tokens, tokens)
+                answer_tokens = response.usage.completion_tokens
+            else:
+                answer_tokens = self.count_tokens(content)
+            self.add_record("user", message, tokens)
+            self.add_record("assistant", content, answer_tokens)
+            self.rate_limiter.record(answer_tokens)
+
+            return content
         
         except Exception as e:
             pass
             return f"An error occurred while communicating with GPT.\nError: {e}"
 
-    def count_tokens(self, prompt):
+    def count_tokens(self, prompt, deadline=None):
         """
-        Counts the number of tokens in a prompt.
+        Counts the number of tokens in a prompt. Counting is local, so the deadline is ignored.
         
         Args:
         - prompt (str): The prompt to count tokens for.
+        - deadline (Deadline, optional): The time budget of the call. Defaults to None.
         
         Returns:
         - int: The number of tokens in the prompt.
         """
+        import tiktoken
         try:
             encoding = tiktoken.encoding_for_model(self.model)
         except KeyError:
             encoding = tiktoken.get_encoding("o200k_base")
         return len(encoding.encode(prompt))
 
-    def clear_history(self):
+class LocalLLMAPI(ChatHistory):
+    """
+    This class encapsulates functionalities related to interacting with a self-hosted LLM behind an OpenAI-compatible API, such as vLLM or llama.cpp.
+
+    These servers batch the requests they receive at the same time, so `send_batch` sends many messages concurrently to keep them busy.
+    The server has no quota, so there is no rate limiter, and token counts come from the usage it reports.
+    """
+    def __init__(self, gmodel=None):
+        """
+        Initializes a new instance of the LocalLLMAPI class.
+
+        Args:
+        - gmodel (str, optional): The name of the served model to use. Defaults to `settings.LOCAL_LLM_MODEL`, or the first model served.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.base_url = settings.LOCAL_LLM_BASE_URL.rstrip("/")
+        self.concurrency = settings.LOCAL_LLM_CONCURRENCY
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {settings.LOCAL_LLM_API_KEY}"
+        # One connection per concurrent request
+        self.session.mount(self.base_url, HTTPAdapter(pool_maxsize=self.concurrency))
+        self.model = gmodel or settings.LOCAL_LLM_MODEL
+        if not self.model:
+            response = self.session.get(f"{self.base_url}/models", timeout=settings.LLM_TIMEOUT)
+            response.raise_for_status()
+            self.model = response.json()["data"][0]["id"]
+        self.init_history(settings.LOCAL_LLM_MAX_TOKENS)
+
+    def start_chat(self, prompt):
+        """
+        Starts a new chat session with the local LLM.
+
+        Args:
+        - prompt (str): The initial prompt to start the chat session.
+        """
+        self.add_record("system", prompt, self.count_tokens(prompt))
+        self.pinned = len(self.history)
+
+    def complete(self, messages, deadline):
+        """
+        Sends a chat completion request to the server.
+
+        Args:
+        - messages (list): The messages of the chat, as dictionaries with the `role` and `content` keys.
+        - deadline (Deadline): The time budget of the call.
+
+        Returns:
+        - tuple: The response message and the usage reported by the server, which may be empty.
+        """
+        response = self.session.post(
+            f"{self.base_url}/chat/completions",
+            json={"model": self.model, "messages": messages},
+            timeout=deadline.timeout(settings.LLM_TIMEOUT)
+        )
+        response.raise_for_status()
+        result = response.json()
+        return result["choices"][0]["message"]["content"], result.get("usage") or {}
+
+    def send_message(self, message, deadline=None):
+        """
+        Sends a message to the local LLM and retrieves the response.
+        The history sent along is trimmed to make room for the message.
+
+        Args:
+        - message (str): The message to send to the server.
+        - deadline (Deadline, optional): The time budget of the call. Defaults to None.
+
+        Returns:
+        - str: The response message from the server.
+        """
+        deadline = deadline or Deadline()
+        try:
+            tokens = self.count_tokens(message)
+            self.trim_history(tokens)
+            messages = [{"role": record["role"], "content": record["content"]} for record in self.history]
+            messages.append({"role": "user", "content": message})
+            content, usage = self.complete(messages, deadline)
+            if "prompt_tokens" in usage:
+                # The prompt count covers the whole history, the message is what it adds
+                tokens = max(usage["prompt_tokens"] - self.tokens, 0)
+            self.add_record("user", message, tokens)
+            self.add_record("assistant", content, usage.get("completion_tokens", self.count_tokens(content)))
+            return content
+
+        except Exception as e:
+            pass
+            return f"An error occurred while communicating with the local LLM.\nError: {e}"
+
+    def send_batch(self, messages, deadline=None, deadlines=None):
+        """
+        Sends many independent messages at once, up to `settings.LOCAL_LLM_CONCURRENCY` at a time.
+        Each message is only sent along with the starting prompt, and neither of them is added to the history.
+
+        Args:
+        - messages (list[str]): The messages to send.
+        - deadline (Deadline, optional): The time budget of the whole batch. Defaults to None.
+        - deadlines (list[Deadline], optional): The time budget of each message, used instead of the deadline. Defaults to None.
+
+        Returns:
+        - list[str]: The response to each message, in the same order.
         """
-        Clears the chat history and token count.
+        deadline = deadline or Deadline()
+        deadlines = deadlines or [deadline] * len(messages)
+        starting_messages = [{"role": record["role"], "content": record["content"]} for record in self.history[:self.pinned]]
+        def send(message, deadline):
+            try:
+                return self.complete(starting_messages + [{"role": "user", "content": message}], deadline)[0]
+            except Exception as e:
+                return f"An error occurred while communicating with the local LLM.\nError: {e}"
+        if not messages:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(messages))) as executor:
+            return list(executor.map(send, messages, deadlines))
+
+    def count_tokens(self, prompt, deadline=None):
         """
-        starting_prompt = self.messages[0]
-        self.messages = [starting_prompt]
-        self.tokens = self.count_tokens(starting_prompt['content'])
+        Estimates the number of tokens in a prompt. The served model has its own tokenizer, so this is a
+        conservative estimate that the usage reported by the server replaces once the prompt is sent.
+
+        Args:
+        - prompt (str): The prompt to count tokens for.
+        - deadline (Deadline, optional): The time budget of the call. Defaults to None.
+
+        Returns:
+        - int: The estimated number of tokens in the prompt.
+        """
+        return len(prompt) // 3 + 1
+
+LLM_REGISTRY = {
+  LLMEnum.GEMINI: GeminiAPI,
+  LLMEnum.CHATGPT: ChatGPTAPI,
+  LLMEnum.LOCAL: LocalLLMAPI,
+  #add more models if needed here
+}
+
 def get_model(llm):
   """
   **Returns an instance of the specified Large Language Model (LLM).**
 
+  The SDK of each provider is only imported when its first client is created.
+
   **Args:**
   - `llm` (LLMEnum): The enum representing the desired LLM.
 
   **Returns:**
   - `object`: An instance of the specified LLM class.
   """
-  if llm == LLMEnum.GEMINI:
-    model = GeminiAPI()
-  elif llm == LLMEnum.CHATGPT:
-    model = ChatGPTAPI()
-  #add more models if needed here
+  return LLM_REGISTRY[llm]()
 
-  return model
-  
-def evaluate(response, product, model):
+def similarity(response, ground_truth):
+  """
+  **Computes the fuzzy similarity between a spec sheet and its ground truth.**
+
+  **Args:**
+  - `response` (dict): The spec sheet generated by the LLM.
+  - `ground_truth` (dict): The ground truth attributes of the product.
+
+  **Returns:**
+  - `dict`: The verdict and the average fuzzy ratio of the attributes present in both, from 0 to 100.
+  """
+  from thefuzz import fuzz
+  similarities = []
+
+  for key in ground_truth.keys():
+    if key in response and key != 'description':
+      similarities.append(fuzz.ratio(response[key], ground_truth[key]))
+  average = sum(similarities)/len(similarities) if similarities else 0
+  if average < 50:
+    return {"veredict":"Incorrect","score":average}
+  elif average < 80:
+    return {"veredict":"Inconsistencies found","score":average}
+  return {"veredict":"Correct","score":average}
+
+def evaluate(response, product, model, deadline=None):
   """
   **Evaluates the response generated by an LLM for a given product against its ground truth.**
 
@@ -292,6 +639,7 @@ def evaluate(response, product, model):
   - `response` (dict): The response generated by the LLM.
   - `product` (GroundTruthProduct): The ground truth product against which the response is evaluated.
   - `model`: The LLM used to generate evaluate the response.
+  - `deadline` (Deadline, optional): The time budget of the LLM evaluation. Defaults to None.
 
   **Returns:**
   - `list`: A list containing the response, ground truth, similarity score, and LLM evaluation results.
@@ -301,25 +649,16 @@ def evaluate(response, product, model):
       - `llm_evaluation` (dict): The evaluation of the response by the LLM.
   """
   ground_truth = product.to_json()
-  similarities = []
-
-  for key in ground_truth.keys():
-    if key in response and key != 'description':
-      similarities.append(fuzz.ratio(response[key], ground_truth[key]))
-  average = sum(similarities)/len(similarities)
-  if average < 50:
-    similarity_score = {"veredict":"Incorrect","score":average}
-  elif average < 80:
-    similarity_score = {"veredict":"Inconsistencies found","score":average}
-  else:
-    similarity_score = {"veredict":"Correct","score":average}
+  similarity_score = similarity(response, ground_truth)
 
   ground_truth_no_desc = {key: value for key, value in ground_truth.items() if key != 'description'}
   response_no_desc = {key: value for key, value in response.items() if key != 'description'}
-  llm_evaluation = model.send_message(f"{ground_truth_no_desc}\n{response_no_desc}")
+  llm_evaluation = model.send_message(f"{ground_truth_no_desc}\n{response_no_desc}", deadline)
 
   try:
     llm_evaluation = json.loads(process_json(llm_evaluation))
+    if not isinstance(llm_evaluation, dict):
+      llm_evaluation = {"veredict":None,"reasoning":llm_evaluation}
   except json.JSONDecodeError:
     llm_evaluation = {"veredict":None,"reasoning":llm_evaluation}
   return [response,ground_truth,similarity_score,llm_evaluation]
@@ -347,42 +686,562 @@ def build_payload(key,id,query,start=1,num=10):
   }
   return payload
 
-def search_google(product, model):
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+class PageRejected(Exception):
+  """
+  Raised when a page can never be used as context, carrying the reason and whatever text was gathered until then.
+  """
+  def __init__(self, reason, text=""):
+    super().__init__(f"The page was rejected ({reason}).")
+    self.reason = reason
+    self.text = text
+
+class PageTextParser(HTMLParser):
+  """
+  This class collects the visible text of an HTML page as it is fed, skipping scripts and styles.
+  """
+  SKIPPED_TAGS = ("script", "style", "template")
+  def __init__(self):
+    super().__init__()
+    self.parts = []
+    self.length = 0
+    self.skipping = 0
+  def handle_starttag(self, tag, attrs):
+    if tag in self.SKIPPED_TAGS:
+      self.skipping += 1
+  def handle_endtag(self, tag):
+    if tag in self.SKIPPED_TAGS and self.skipping:
+      self.skipping -= 1
+  def handle_data(self, data):
+    if not self.skipping:
+      self.parts.append(data)
+      self.length += len(data)
+  def get_text(self):
+    """
+    **Returns the text collected so far.**
+    """
+    return "".join(self.parts)
+
+def detect_encoding(head, charset=None):
+  """
+  **Detects the encoding of a page from the Content-Type charset, its meta tags or its first bytes.**
+
+  **Args:**
+  - `head` (bytes): The first bytes of the page.
+  - `charset` (str, optional): The charset of the Content-Type header, if any.
+
+  **Returns:**
+  - `str`: The name of the encoding.
+  """
+  from bs4.dammit import EncodingDetector, UnicodeDammit
+  for encoding in (charset, EncodingDetector.find_declared_encoding(head, is_html=True)):
+    if encoding:
+      try:
+        return codecs.lookup(encoding).name
+      except LookupError:
+        pass
+  try:
+    # The head may end in the middle of a character, so decode it incrementally
+    codecs.getincrementaldecoder("utf-8")().decode(head)
+    return "utf-8"
+  except UnicodeDecodeError:
+    return UnicodeDammit(head, is_html=True).original_encoding or "windows-1252"
+
+def fetch_page(url, max_chars, max_bytes=None, timeout=5, deadline=None):
+  """
+  **Streams an HTML page and extracts its text, giving up as soon as it is too large to be used.**
+
+  **Args:**
+  - `url` (str): The URL of the page.
+  - `max_chars` (int): The maximum number of characters of text to gather.
+  - `max_bytes` (int, optional): The maximum number of bytes to download. Defaults to `settings.FETCH_MAX_BYTES`.
+  - `timeout` (int, optional): The timeout of the request in seconds. Defaults to 5.
+  - `deadline` (Deadline, optional): The time budget of the download. Defaults to None.
+
+  **Returns:**
+  - `str`: The text of the page, or `None` if the server did not answer with a 200 status, which may only be temporary.
+
+  **Raises:**
+  - `DeadlineExceeded`: If the deadline runs out during the download, with the text gathered so far.
+  - `PageRejected`: If the page is not HTML (`not_html`), or is over the limits (`too_long`) with the text gathered so far.
+  """
+  import requests
+  max_bytes = max_bytes or settings.FETCH_MAX_BYTES
+  deadline = deadline or Deadline()
+  with requests.get(url, timeout=deadline.timeout(timeout), stream=True) as response:
+    if response.status_code != 200:
+      return None
+    content_type, _, params = response.headers.get("Content-Type", "").partition(";")
+    if content_type.strip() and content_type.strip().lower() not in HTML_CONTENT_TYPES:
+      raise PageRejected("not_html")
+    if int(response.headers.get("Content-Length") or 0) > max_bytes:
+      raise PageRejected("too_long")
+    charset = None
+    for param in params.split(";"):
+      key, _, value = param.partition("=")
+      if key.strip().lower() == "charset":
+        charset = value.strip().strip('"\'')
+
+    parser = PageTextParser()
+    decoder = None
+    downloaded = 0
+    for chunk in response.iter_content(chunk_size=16384):
+      downloaded += len(chunk)
+      if downloaded > max_bytes:
+        raise PageRejected("too_long", parser.get_text())
+      if decoder is None:
+        decoder = codecs.getincrementaldecoder(detect_encoding(chunk, charset))(errors="replace")
+      parser.feed(decoder.decode(chunk))
+      if parser.length > max_chars:
+        raise PageRejected("too_long", parser.get_text())
+      if deadline.expired():
+        raise DeadlineExceeded(parser.get_text())
+    if decoder is not None:
+      parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+  return parser.get_text()
+
+def simhash(text, bits=64):
+  """
+  **Computes the simhash fingerprint of a text, which only differs in a few bits between near-duplicate texts.**
+
+  **Args:**
+  - `text` (str): The text to fingerprint.
+  - `bits` (int, optional): The size of the fingerprint. Defaults to 64.
+
+  **Returns:**
+  - `int`: The fingerprint, built from the hashes of the distinct sequences of three consecutive words.
+  """
+  words = re.findall(r"\w+", text.lower())
+  hashes = [
+    int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=bits//8).digest(), "big")
+    for shingle in {" ".join(words[i:i+3]) for i in range(max(len(words)-2, 1))}
+  ]
+  fingerprint = 0
+  for bit in range(bits):
+    if 2*sum(h >> bit & 1 for h in hashes) > len(hashes):
+      fingerprint |= 1 << bit
+  return fingerprint
+
+def page_fingerprint(text):
+  """
+  **Computes the fingerprint of the text of a page from its first `settings.FINGERPRINT_CHARS` characters.**
+
+  Pages cut short by the size limits then get the same fingerprint as their whole text.
+
+  **Args:**
+  - `text` (str): The text of the page.
+
+  **Returns:**
+  - `int`: The simhash of the text.
+  """
+  return simhash(text[:settings.FINGERPRINT_CHARS])
+
+def is_near_duplicate(fingerprint, fingerprints):
+  """
+  **Checks if a fingerprint is within `settings.SIMHASH_MAX_DISTANCE` bits of any of the given ones.**
+  """
+  return any((fingerprint ^ other).bit_count() <= settings.SIMHASH_MAX_DISTANCE for other in fingerprints)
+
+def fetch_cached_page(url, max_chars, deadline=None):
+  """
+  **Returns the text and fingerprint of a page, fetching and storing it as a `FetchedPage` if it was not fetched before.**
+
+  **Args:**
+  - `url` (str): The URL of the page.
+  - `max_chars` (int): The maximum number of characters of text to gather.
+  - `deadline` (Deadline, optional): The time budget of the download. Defaults to None.
+
+  **Returns:**
+  - `tuple`: The text of the page and its fingerprint (`None` if the text is empty), or `(None, None)` if the page is not available right now.
+
+  **Raises:**
+  - `DeadlineExceeded`: If the deadline runs out during the download, with the text gathered so far.
+  - `PageRejected`: If the page is not HTML or is over the limits, with the text gathered so far.
+  """
+  page = FetchedPage.objects.filter(url=url).first()
+  if page is not None:
+    if len(page.text) > max_chars:
+      raise PageRejected("too_long", page.text)
+    return page.text, int(page.fingerprint, 16)
+  text = fetch_page(url, max_chars, deadline=deadline)
+  if not text:
+    return text, None
+  fingerprint = page_fingerprint(text)
+  FetchedPage.objects.update_or_create(url=url, defaults={"text": text, "fingerprint": f"{fingerprint:016x}"})
+  return text, fingerprint
+
+# Token limit recorded for the pages that are useless for every model
+ANY_MODEL_TOKENS = 2**31 - 1
+
+def search_google(product, model, deadline=None, max_pages=None):
   """
   **Searches Google for information related to the given product and generates a prompt for the LLM based on the search results.**
 
   **Args:**
   - `product` (str): The product to search for.
   - `model`: The LLM used for generating prompts.
+  - `deadline` (Deadline, optional): The time budget of the search. Defaults to None.
+  - `max_pages` (int, optional): The maximum number of result pages to look at. Defaults to `settings.SEARCH_MAX_PAGES`.
 
   **Returns:**
-  - `str`: A prompt generated based on the search results.
-  """
-  i = 0
-  while True:
-    results = requests.get(
-      'https://customsearch.googleapis.com/customsearch/v1',
-      params=build_payload(
-        settings.API_KEY_CSE,
-        settings.SEARCH_ENGINE_ID,
-        product,
-        1+i*10)).json()
-    items = results['items']
+  - `tuple`: The prompt generated based on the search results, or the bare product if no usable page was found, and the `SearchEnum` outcome of the search.
+  """
+  import requests
+  deadline = deadline or Deadline()
+  max_pages = max_pages or settings.SEARCH_MAX_PAGES
+  # Pages already found useless for this query by a model with at least the same token limit
+  useless = {page.url: page for page in UselessPage.objects.filter(query=product, max_tokens__gte=model.max_tokens)}
+  seen = [int(page.fingerprint, 16) for page in useless.values() if page.fingerprint]
+  def mark_useless(url, reason, fingerprint=None):
+    UselessPage.objects.update_or_create(query=product, url=url, defaults={
+      "reason": reason,
+      "fingerprint": "" if fingerprint is None else f"{fingerprint:016x}",
+      "max_tokens": model.max_tokens if reason in ("too_long", "duplicate") else ANY_MODEL_TOKENS})
+    if fingerprint is not None:
+      seen.append(fingerprint)
+  for i in range(max_pages):
+    if deadline.expired():
+      return product, SearchEnum.TIMEOUT
+    try:
+      results = requests.get(
+        'https://customsearch.googleapis.com/customsearch/v1',
+        params=build_payload(
+          settings.API_KEY_CSE,
+          settings.SEARCH_ENGINE_ID,
+          product,
+          1+i*10),
+        timeout=deadline.timeout(5)).json()
+    except Exception as e:
+      break
+    items = results.get('items', [])
+    if not items:
+      break
     for item in items:
+      if deadline.expired():
+        return product, SearchEnum.TIMEOUT
+      url = item['link']
+      if url in useless:
+        continue
+      outcome = SearchEnum.CONTEXT
       try:
-        response = requests.get(item['link'], timeout=5)
-        if response.status_code == 200:
-          soup = BeautifulSoup(response.text, 'html.parser')
-          prompt = f"<context>{soup.get_text().replace("\n\n\n\n","\n")}</context>\n{product}"
-          tokens = model.count_tokens(prompt)
-          if model.max_tokens > tokens:
-            if tokens+model.tokens >= model.max_tokens:
-              model.clear_history()
-            return prompt
+        try:
+          text, fingerprint = fetch_cached_page(url, model.max_tokens * settings.FETCH_CHARS_PER_TOKEN, deadline)
+        except DeadlineExceeded as e:
+          # Use whatever was downloaded before the budget ran out
+          text, fingerprint, outcome = e.text, None, SearchEnum.PARTIAL
+        except PageRejected as e:
+          fingerprint = page_fingerprint(e.text) if e.text else None
+          if fingerprint is not None and e.reason == "too_long" and is_near_duplicate(fingerprint, seen):
+            mark_useless(url, "duplicate", fingerprint)
           else:
-            pass
-        else:
+            mark_useless(url, e.reason, fingerprint)
+          continue
+        if text is None:
+          # Such as a 429 or 503 status, so it is tried again by the next search
           pass
+        elif not text:
+          if outcome != SearchEnum.PARTIAL:
+            mark_useless(url, "no_text")
+        elif fingerprint is not None and is_near_duplicate(fingerprint, seen):
+          # Mirrors of a page that did not fit would not fit either
+          mark_useless(url, "duplicate", fingerprint)
+        else:
+          text = text.replace("\n\n\n\n","\n")
+          prompt = f"<context>{text}</context>\n{product}"
+          tokens = model.count_tokens(prompt, deadline)
+          if model.max_tokens > tokens:
+            return prompt, outcome
+          if fingerprint is not None:
+            mark_useless(url, "too_long", fingerprint)
       except Exception as e:
         pass
-    i += 1
\ No newline at end of file
+      if outcome == SearchEnum.PARTIAL:
+        return product, SearchEnum.TIMEOUT
+  return product, SearchEnum.NO_CONTEXT
+
+def get_product_prompt(product, model, llm, google_search=True, stored_context=False, deadline=None):
+  """
+  **Returns the prompt to send to the Maker LLM for a product.**
+
+  **Args:**
+  - `product` (str): The product query.
+  - `model`: The LLM the prompt is sent to.
+  - `llm` (LLMEnum): The enum of the LLM, used to look up stored contexts.
+  - `google_search` (bool, optional): Whether to search Google for context. Defaults to True.
+  - `stored_context` (bool, optional): Whether to use the context stored by `prewarm_contexts` instead of searching Google. Products without a stored context are sent without context. Defaults to False.
+  - `deadline` (Deadline, optional): The time budget of the search. Defaults to None.
+
+  **Returns:**
+  - `tuple`: The prompt for the product and the `SearchEnum` outcome of getting its context.
+  """
+  if stored_context:
+    context = SearchContext.objects.filter(query=product, llm=llm.value).first()
+    if context is None:
+      return product, SearchEnum.NO_CONTEXT
+    return context.prompt, SearchEnum.STORED
+  if google_search:
+    return search_google(product, model, deadline)
+  return product, SearchEnum.DISABLED
+
+def parse_sheet(response):
+  """
+  **Parses the response of the Maker into a spec sheet.**
+
+  **Args:**
+  - `response` (str): The response of the Maker.
+
+  **Returns:**
+  - `tuple`: The JSON of the spec sheet and the spec sheet as a dictionary, or `None` if the response is not a valid JSON object.
+  """
+  raw_data = process_json(response)
+  try:
+    data = json.loads(raw_data)
+  except json.JSONDecodeError:
+    return raw_data, None
+  return raw_data, data if isinstance(data, dict) else None
+
+CONFIDENCE_PROMPT = 'Also add a "confidence" key to the JSON, with a number from 0 to 1 telling how sure you are of every value of the spec sheet.'
+PLACEHOLDER_VALUES = {"", "-", "?", "n/a", "na", "none", "null", "unknown", "not available", "not specified", "tbd"}
+
+def needs_search(data, attributes):
+  """
+  **Decides whether a spec sheet generated without context must be regenerated with a Google search.**
+
+  **Args:**
+  - `data` (dict): The spec sheet, or `None` if it is not a valid JSON object.
+  - `attributes` (list): The names of the attributes of the category, none of which may be missing or empty.
+
+  **Returns:**
+  - `bool`: Whether the spec sheet is invalid, misses an attribute, contains a placeholder value, or its `confidence` is missing or under `settings.ADAPTIVE_CONFIDENCE_THRESHOLD`.
+  """
+  if data is None:
+    return True
+  if any(not str(data.get(attribute) or "").strip() for attribute in attributes):
+    return True
+  if any(isinstance(value, str) and value.strip().lower() in PLACEHOLDER_VALUES for key, value in data.items() if key != "confidence"):
+    return True
+  try:
+    return float(data["confidence"]) < settings.ADAPTIVE_CONFIDENCE_THRESHOLD
+  except (KeyError, TypeError, ValueError):
+    return True
+
+def needs_escalation(data, attributes, ground_truth=None):
+  """
+  **Decides whether a spec sheet from the cheap model of a cascade must be regenerated by the stronger one.**
+
+  **Args:**
+  - `data` (dict): The spec sheet, or `None` if it is not a valid JSON object.
+  - `attributes` (list): The names of the attributes of the category, none of which may be missing or empty.
+  - `ground_truth` (dict, optional): The ground truth of the product. If given, the spec sheet must also score at least `settings.CASCADE_SCORE_THRESHOLD`.
+
+  **Returns:**
+  - `bool`: Whether the spec sheet must be escalated.
+  """
+  if data is None:
+    return True
+  if any(not str(data.get(attribute) or "").strip() for attribute in attributes):
+    return True
+  return ground_truth is not None and similarity(data, ground_truth)["score"] < settings.CASCADE_SCORE_THRESHOLD
+
+def generate_sheet(product, model, copywriter_model, llm, google_search=True, stored_context=False, deadline=None, cheap_model=None, attributes=(), ground_truth=None, adaptive_search=False):
+  """
+  **Generates the spec sheet and description of a product.**
+
+  The search for context gets at most `settings.SEARCH_TIME_BUDGET` seconds of the deadline, and the Maker runs afterwards with whatever context was found.
+  With a cascade, the cheap model answers first and the Maker only regenerates the spec sheet when `needs_escalation` rejects it.
+  The context is then sized for the smaller token window of the two, so the same prompt can be escalated.
+  With adaptive search, the spec sheet is first generated without context, and Google is only searched when `needs_search` rejects it.
+
+  **Args:**
+  - `product` (str): The product query.
+  - `model`: The "Maker" LLM, with its chat already started.
+  - `copywriter_model`: The "Copywriter" LLM, with its chat already started.
+  - `llm` (LLMEnum): The enum of the Maker LLM, used to look up stored contexts.
+  - `google_search` (bool, optional): Whether to search Google for context. Defaults to True.
+  - `stored_context` (bool, optional): Whether to use the context stored by `prewarm_contexts`. Defaults to False.
+  - `deadline` (Deadline, optional): The time budget of the product. Defaults to None.
+  - `cheap_model` (optional): The cheap "Maker" LLM of a cascade, with its chat already started. Defaults to None.
+  - `attributes` (list, optional): The attributes of the category checked before escalating. Defaults to ().
+  - `ground_truth` (dict, optional): The ground truth of the product checked before escalating. Defaults to None.
+  - `adaptive_search` (bool, optional): Whether to search Google only when the spec sheet generated without context is not good enough. Only applies to live searches. Defaults to False.
+
+  **Returns:**
+  - `tuple`: The raw response of the Maker, the spec sheet as a dictionary (or `None` if the response is not valid JSON), the `SearchEnum` outcome of the search and the `TierEnum` of the model that answered.
+  """
+  deadline = deadline or Deadline()
+  first_model = cheap_model or model
+  # The prompt may be escalated to the Maker, so it must fit both token windows
+  context_model = min(first_model, model, key=lambda llm_model: llm_model.max_tokens)
+  adaptive_search = adaptive_search and google_search and not stored_context
+  if adaptive_search:
+    prompt, outcome = f"{product}\n{CONFIDENCE_PROMPT}", SearchEnum.NOT_NEEDED
+    response = first_model.send_message(prompt, deadline)
+    raw_data, data = parse_sheet(response)
+    if needs_search(data, attributes):
+      context_prompt, outcome = get_product_prompt(product, context_model, llm, google_search, stored_context, Deadline(settings.SEARCH_TIME_BUDGET, deadline))
+      # Without any context found, the first answer is as good as a new one
+      if outcome in (SearchEnum.CONTEXT, SearchEnum.PARTIAL):
+        prompt = context_prompt
+        response = first_model.send_message(prompt, deadline)
+        raw_data, data = parse_sheet(response)
+  else:
+    prompt, outcome = get_product_prompt(product, context_model, llm, google_search, stored_context, Deadline(settings.SEARCH_TIME_BUDGET, deadline))
+    response = first_model.send_message(prompt, deadline)
+    raw_data, data = parse_sheet(response)
+  tier = TierEnum.SINGLE
+  if cheap_model is not None:
+    tier = TierEnum.CHEAP
+    if needs_escalation(data, attributes, ground_truth):
+      tier = TierEnum.ESCALATED
+      response = model.send_message(prompt, deadline)
+      raw_data, data = parse_sheet(response)
+  if data is None:
+    return response, None, outcome, tier
+  if adaptive_search and "confidence" in data:
+    data.pop("confidence")
+    raw_data = json.dumps(data, ensure_ascii=False)
+  data['description'] = copywriter_model.send_message(raw_data, deadline)
+  return response, data, outcome, tier
+
+def generate_sheets_batch(products, model, copywriter_model, llm, google_search=True, stored_context=False, deadline=None):
+  """
+  **Generates the spec sheets of many products at once with a Maker that supports `send_batch`.**
+
+  The contexts of the products are gathered concurrently, up to `settings.LOCAL_LLM_CONCURRENCY` at a time, then all the prompts
+  are sent in a single batch, followed by the descriptions of the valid spec sheets, batched too if the copywriter supports it.
+  Each product gets `settings.PRODUCT_TIME_BUDGET` seconds from the start of its context lookup, of which at most
+  `settings.SEARCH_TIME_BUDGET` are spent searching.
+
+  **Args:**
+  - `products` (list[str]): The product queries.
+  - `model`: The Maker LLM, with a `send_batch` method.
+  - `copywriter_model`: The LLM that writes the descriptions.
+  - `llm` (LLMEnum): The enum of the Maker, used to look up stored contexts.
+  - `google_search` (bool, optional): Whether to search Google for context. Defaults to True.
+  - `stored_context` (bool, optional): Whether to use the context stored by `prewarm_contexts` instead of searching Google. Defaults to False.
+  - `deadline` (Deadline, optional): The time budget of the whole batch. Products whose context lookup has not started when it runs out are skipped. Defaults to None.
+
+  **Returns:**
+  - `list[tuple]`: The response of the Maker, the spec sheet with its description (or `None` if the response is not valid JSON) and the `SearchEnum` outcome of each product, in order.
+  """
+  from django.db import connection
+  deadline = deadline or Deadline()
+  def get_context(product):
+    if deadline.expired():
+      return None
+    product_deadline = Deadline(settings.PRODUCT_TIME_BUDGET, deadline)
+    try:
+      prompt, outcome = get_product_prompt(product, model, llm, google_search, stored_context, Deadline(settings.SEARCH_TIME_BUDGET, product_deadline))
+    finally:
+      # Each thread opens its own database connection
+      connection.close()
+    return prompt, outcome, product_deadline
+  if not products:
+    return []
+  with ThreadPoolExecutor(max_workers=min(settings.LOCAL_LLM_CONCURRENCY, len(products))) as executor:
+    contexts = list(executor.map(get_context, products))
+  started = [i for i, context in enumerate(contexts) if context is not None]
+  prompts = [contexts[i][0] for i in started]
+  deadlines = [contexts[i][2] for i in started]
+  responses = model.send_batch(prompts, deadline, deadlines)
+  sheets = [parse_sheet(response) for response in responses]
+  valid = [i for i, (raw_data, data) in enumerate(sheets) if data is not None]
+  raw_sheets = [sheets[i][0] for i in valid]
+  if hasattr(copywriter_model, "send_batch"):
+    descriptions = copywriter_model.send_batch(raw_sheets, deadline, [deadlines[i] for i in valid])
+  else:
+    descriptions = [copywriter_model.send_message(sheets[i][0], deadlines[i]) for i in valid]
+  for i, description in zip(valid, descriptions):
+    sheets[i][1]['description'] = description
+  results = [(None, None, SearchEnum.SKIPPED)] * len(products)
+  for i, response, (raw_data, data) in zip(started, responses, sheets):
+    results[i] = (response, data, contexts[i][1])
+  return results
+
+def run_test(llm, judge, copywriter, category, google_search=True, stored_context=False, lang="en", number=4, version=2, cascade=None, adaptive_search=False, deadline=None):
+  """
+  **Generates and evaluates the spec sheets of every ground truth product in a category.**
+
+  **Args:**
+  - `llm` (LLMEnum): The LLM used to generate the spec sheets.
+  - `judge` (LLMEnum): The LLM used to evaluate the generated spec sheets.
+  - `copywriter` (LLMEnum): The LLM used to generate product descriptions.
+  - `category` (int): The category ID of the products to be tested.
+  - `google_search` (bool, optional): Whether to use Google search to gather context for the products. Defaults to True.
+  - `stored_context` (bool, optional): Whether to use the contexts stored by `prewarm_contexts` instead of searching Google. Defaults to False.
+  - `lang` (str, optional): The language for the copywriter model. Defaults to "en".
+  - `number` (int, optional): The prompt number for the "Maker" LLM. Defaults to 4.
+  - `version` (int, optional): The prompt version for the "Maker" LLM. Defaults to 2.
+  - `cascade` (LLMEnum, optional): A cheaper LLM that generates the spec sheets first, escalating to `llm` when they are invalid, incomplete or score under `settings.CASCADE_SCORE_THRESHOLD`. Defaults to None.
+  - `adaptive_search` (bool, optional): Whether to search Google only for the products the Maker cannot answer confidently without context. Defaults to False.
+  - `deadline` (Deadline, optional): The time budget of the whole test. Defaults to `settings.REQUEST_TIME_BUDGET` seconds.
+
+  Without cascade nor adaptive search, a Maker that supports batches (`local`) gets every product at once, as in `run_test_batch`.
+
+  **Yields:**
+  - `EvaluationRow`: The spec sheet, ground truth, similarity score, LLM evaluation, search outcome, cascade tier and latency of each product. Products left when the budget runs out are skipped.
+  """
+  model = get_model(llm)
+  cheap_model = get_model(cascade) if cascade else None
+  judge_model = get_model(judge)
+  copywriter_model = get_model(copywriter)
+
+  model.start_chat(get_prompt("Maker",category, number, version))
+  judge_model.start_chat(get_prompt("Judge",category, 1, 1))
+  copywriter_model.start_chat(get_prompt("Copywriter",category, 1, 1, lang))
+  if cheap_model is not None:
+    cheap_model.start_chat(get_prompt("Maker",category, number, version))
+  attributes = get_category_attributes(category)
+
+  request_deadline = deadline or Deadline(settings.REQUEST_TIME_BUDGET)
+  if cheap_model is None and not adaptive_search and hasattr(model, "send_batch"):
+    yield from run_test_batch(model, judge_model, copywriter_model, llm, category, google_search, stored_context, request_deadline)
+    return
+  for product in get_ground_truth(category):
+    ground_truth = product[1].to_json()
+    if request_deadline.expired():
+      yield EvaluationRow(ground_truth=ground_truth, search=SearchEnum.SKIPPED)
+      continue
+    start = time.monotonic()
+    deadline = Deadline(settings.PRODUCT_TIME_BUDGET, request_deadline)
+    response, data, outcome, tier = generate_sheet(product[0], model, copywriter_model, llm, google_search, stored_context, deadline, cheap_model, attributes, ground_truth, adaptive_search)
+    latency = time.monotonic() - start
+    if data is None:
+      yield EvaluationRow(spec_sheet=response, ground_truth=ground_truth, search=outcome, tier=tier, latency=latency)
+    else:
+      spec_sheet, ground_truth, similarity_score, llm_evaluation = evaluate(data,product[1], judge_model, deadline)
+      yield EvaluationRow(spec_sheet=spec_sheet, ground_truth=ground_truth, similarity_score=similarity_score, llm_evaluation=llm_evaluation, search=outcome, tier=tier, latency=latency)
+
+def run_test_batch(model, judge_model, copywriter_model, llm, category, google_search=True, stored_context=False, deadline=None):
+  """
+  **Generates the spec sheets of every ground truth product in a category with `generate_sheets_batch`, then evaluates them one by one.**
+
+  **Args:**
+  - `model`: The "Maker" LLM, with a `send_batch` method and its chat already started.
+  - `judge_model`: The "Judge" LLM, with its chat already started.
+  - `copywriter_model`: The "Copywriter" LLM, with its chat already started.
+  - `llm` (LLMEnum): The enum of the Maker, used to look up stored contexts.
+  - `category` (int): The category ID of the products to be tested.
+  - `google_search` (bool, optional): Whether to search Google for context. Defaults to True.
+  - `stored_context` (bool, optional): Whether to use the contexts stored by `prewarm_contexts`. Defaults to False.
+  - `deadline` (Deadline, optional): The time budget of the whole test. Defaults to None.
+
+  **Yields:**
+  - `EvaluationRow`: The row of each product, as in `run_test`, with the latency of the whole batch. Each evaluation gets `settings.PRODUCT_TIME_BUDGET` seconds.
+  """
+  deadline = deadline or Deadline()
+  products = list(get_ground_truth(category))
+  start = time.monotonic()
+  results = generate_sheets_batch([product[0] for product in products], model, copywriter_model, llm, google_search, stored_context, deadline)
+  latency = time.monotonic() - start
+  for product, (response, data, outcome) in zip(products, results):
+    ground_truth = product[1].to_json()
+    if outcome == SearchEnum.SKIPPED:
+      yield EvaluationRow(ground_truth=ground_truth, search=outcome)
+    elif data is None:
+      yield EvaluationRow(spec_sheet=response, ground_truth=ground_truth, search=outcome, tier=TierEnum.SINGLE, latency=latency)
+    else:
+      spec_sheet, ground_truth, similarity_score, llm_evaluation = evaluate(data, product[1], judge_model, Deadline(settings.PRODUCT_TIME_BUDGET, deadline))
+      yield EvaluationRow(spec_sheet=spec_sheet, ground_truth=ground_truth, similarity_score=similarity_score, llm_evaluation=llm_evaluation, search=outcome, tier=TierEnum.SINGLE, latency=latency)
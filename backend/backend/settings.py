@@ -128,8 +128,28 @@ API_KEY_GEMINI = os.getenv("API_KEY_GEMINI","") # Add you API key
 
 API_KEY_OPENAI = os.getenv("API_KEY_OPENAI","") # Add you API key
 
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:8000/v1") # OpenAI-compatible server, such as vLLM or llama.cpp
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "") # Defaults to the first model served
+LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY", "EMPTY")
+LOCAL_LLM_MAX_TOKENS = int(os.getenv("LOCAL_LLM_MAX_TOKENS", 8192)) # Context window of the served model
+LOCAL_LLM_CONCURRENCY = int(os.getenv("LOCAL_LLM_CONCURRENCY", 16)) # Requests sent at once by batches
+
 API_KEY_CSE = os.getenv("API_KEY_CSE") # Add you API key
 SEARCH_ENGINE_ID = os.getenv("SEARCH_ENGINE_ID") # Add your ID
 
 ATTEMPTS_PER_MESSAGE = os.getenv("ATTEMPTS_PER_MESSAGE", 3)
-WAIT_TIME = os.getenv("WAIT_TIME", 15)
\ No newline at end of file
+WAIT_TIME = os.getenv("WAIT_TIME", 15)
+
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", 2 * 1024 * 1024)) # Pages are dropped once they exceed this size
+FETCH_CHARS_PER_TOKEN = int(os.getenv("FETCH_CHARS_PER_TOKEN", 8)) # Pages are dropped once their text is surely over the token limit
+
+SEARCH_MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", 3)) # Pages of 10 Google results looked at per product
+PRODUCT_TIME_BUDGET = float(os.getenv("PRODUCT_TIME_BUDGET", 120)) # Seconds per product, including the LLM calls
+SEARCH_TIME_BUDGET = float(os.getenv("SEARCH_TIME_BUDGET", 45)) # Seconds of the product budget that can be spent searching
+REQUEST_TIME_BUDGET = float(os.getenv("REQUEST_TIME_BUDGET", 1800)) # Seconds per request, remaining products are skipped
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60)) # Seconds per LLM call, bounded by the product budget
+
+CASCADE_SCORE_THRESHOLD = float(os.getenv("CASCADE_SCORE_THRESHOLD", 80)) # Cascade escalates in /test below this similarity score
+ADAPTIVE_CONFIDENCE_THRESHOLD = float(os.getenv("ADAPTIVE_CONFIDENCE_THRESHOLD", 0.8)) # Adaptive search looks for context below this self-reported confidence
+SIMHASH_MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", 10)) # Pages whose fingerprints differ in at most these bits are near-duplicates
+FINGERPRINT_CHARS = int(os.getenv("FINGERPRINT_CHARS", 20000)) # Characters of a page its fingerprint is computed from
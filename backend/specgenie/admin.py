@@ -1,33 +1,104 @@
 from django.contrib import admin
+from django.db.models import Q
+from django.db.models.functions import Upper
 from .models import Category, Prompt, GroundTruthAttribute, GroundTruthProduct, ProductAttribute, PromptRole, PromptLang
 
 class ProductAttributeInline(admin.TabularInline):
+    """
+    Edits the attributes of a ground truth product, picking them with an autocomplete instead of listing every attribute.
+    """
     model = ProductAttribute
+    extra = 1
+    autocomplete_fields = ["attribute"]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("product__category", "attribute")
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "attribute":
+            object_id = request.resolver_match.kwargs.get("object_id")
+            product = GroundTruthProduct.objects.filter(pk=object_id).only("category_id").first() if object_id else None
+            if product is not None:
+                # Only accepts the attributes of the category of the product
+                kwargs["queryset"] = GroundTruthAttribute.objects.filter(category_id=product.category_id)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+class PrefixSearchMixin:
+    """
+    Searches the `prefix_search_fields` for values starting with the search term, ignoring case.
+
+    Django's `^` lookups are LIKEs that cannot use a b-tree index, while ranges over the uppercase
+    values can, through the `Upper` indexes of the fields.
+    """
+    prefix_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip().upper()
+        if not search_term:
+            return queryset, False
+        query = Q()
+        for i, field in enumerate(self.prefix_search_fields):
+            queryset = queryset.alias(**{f"upper_{i}": Upper(field)})
+            query |= Q(**{f"upper_{i}__gte": search_term, f"upper_{i}__lt": search_term + "\U0010ffff"})
+        return queryset.filter(query), False
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    pass
+    search_fields = ["name"]
 
 @admin.register(PromptRole)
-class CategoryAdmin(admin.ModelAdmin):
-    pass
+class PromptRoleAdmin(admin.ModelAdmin):
+    search_fields = ["name"]
 
 @admin.register(PromptLang)
-class CategoryAdmin(admin.ModelAdmin):
-    pass
+class PromptLangAdmin(admin.ModelAdmin):
+    search_fields = ["name"]
 
 @admin.register(Prompt)
-class CategoryAdmin(admin.ModelAdmin):
-    pass
+class PromptAdmin(admin.ModelAdmin):
+    list_display = ["__str__", "category", "role", "lang", "number", "version"]
+    list_filter = ["category", "role", "lang"]
+    list_select_related = ["category", "role", "lang"]
+    autocomplete_fields = ["category", "role", "lang"]
 
 @admin.register(GroundTruthAttribute)
 class GroundTruthAttributeAdmin(admin.ModelAdmin):
-    pass
+    list_display = ["name", "category"]
+    list_filter = ["category"]
+    search_fields = ["name"]
+    ordering = ["name"]
+    autocomplete_fields = ["category"]
+
+    def get_queryset(self, request):
+        # Also used by the autocomplete of ProductAttributeAdmin, which does not apply list_select_related
+        return super().get_queryset(request).select_related("category")
 
 @admin.register(GroundTruthProduct)
-class GroundTruthProductAdmin(admin.ModelAdmin):
+class GroundTruthProductAdmin(PrefixSearchMixin, admin.ModelAdmin):
+    list_display = ["name", "brand", "part_number", "category"]
+    list_filter = ["category"]
+    # Only enables the search box and autocomplete, the search itself is prefix_search_fields
+    search_fields = ["brand", "part_number"]
+    prefix_search_fields = ["brand", "part_number"]
+    search_help_text = "Search by the start of the brand or part number."
+    ordering = ["brand", "part_number"]
+    autocomplete_fields = ["category"]
+    list_per_page = 50
+    show_full_result_count = False
     inlines = [ProductAttributeInline]
 
+    def get_queryset(self, request):
+        # Also used by the autocomplete of ProductAttributeAdmin, which does not apply list_select_related
+        return super().get_queryset(request).select_related("category")
+
 @admin.register(ProductAttribute)
-class ProductAttributeAdmin(admin.ModelAdmin):
-    pass
\ No newline at end of file
+class ProductAttributeAdmin(PrefixSearchMixin, admin.ModelAdmin):
+    list_display = ["__str__", "value"]
+    list_filter = ["attribute__category"]
+    list_select_related = ["product__category", "attribute"]
+    search_fields = ["product__brand", "product__part_number"]
+    prefix_search_fields = ["product__brand", "product__part_number"]
+    search_help_text = "Search by the start of the brand or part number of the product."
+    autocomplete_fields = ["product", "attribute"]
+    list_per_page = 50
+    show_full_result_count = False
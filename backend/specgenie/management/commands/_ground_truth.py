@@ -0,0 +1,101 @@
+import csv
+import json
+import sys
+from pathlib import Path
+
+FORMATS = ("csv", "jsonl")
+PRODUCT_FIELDS = ("category", "name", "brand", "part_number", "description")
+
+def detect_format(path, fmt=None):
+    """
+    **Returns the ground truth file format to use for a path.**
+
+    **Args:**
+    - `path` (str): The path of the file, or `-` for stdin/stdout.
+    - `fmt` (str, optional): The format given on the command line, if any.
+
+    **Returns:**
+    - `str`: Either `csv` or `jsonl`.
+    """
+    if fmt:
+        return fmt
+    suffix = Path(path).suffix.lower().lstrip(".")
+    if suffix in ("jsonl", "ndjson"):
+        return "jsonl"
+    return "csv"
+
+def open_stream(path, mode):
+    """
+    **Opens a text stream for a path, mapping `-` to stdin or stdout.**
+    """
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    return open(path, mode, encoding="utf-8", newline="")
+
+def read_rows(stream, fmt):
+    """
+    **Lazily reads ground truth rows from a CSV or JSONL stream.**
+
+    Every CSV column that is not a product field is read as an attribute and empty cells are skipped.
+    JSONL lines carry the attributes in an `attributes` object. Product fields missing from the file
+    or the line, or in empty CSV cells, are left out of the row, so that updates keep their stored value.
+
+    **Args:**
+    - `stream`: The text stream to read from.
+    - `fmt` (str): Either `csv` or `jsonl`.
+
+    **Yields:**
+    - `dict`: A dictionary with the product fields and an `attributes` dictionary.
+
+    **Raises:**
+    - `ValueError`: If a line is not a JSON object or its `attributes` are not an object.
+    """
+    if fmt == "jsonl":
+        for line in stream:
+            line = line.strip()
+            if line:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError(f"{line!r} is not a JSON object")
+                row.setdefault("attributes", {})
+                if not isinstance(row["attributes"], dict):
+                    raise ValueError(f"the attributes of {line!r} are not a JSON object")
+                yield row
+    else:
+        for record in csv.DictReader(stream):
+            # Empty cells are left out too, so that updates keep their stored value
+            fields = {field: record.pop(field) for field in PRODUCT_FIELDS if field in record}
+            row = {field: value for field, value in fields.items() if value}
+            row["attributes"] = {key: value for key, value in record.items() if key and value}
+            yield row
+
+class RowWriter:
+    """
+    Writes ground truth rows to a CSV or JSONL stream one at a time.
+    """
+    def __init__(self, stream, fmt, attributes=()):
+        """
+        **Initializes a new row writer.**
+
+        **Args:**
+        - `stream`: The text stream to write to.
+        - `fmt` (str): Either `csv` or `jsonl`.
+        - `attributes` (iterable, optional): The attribute columns of a CSV file.
+        """
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == "csv":
+            self.writer = csv.DictWriter(stream, fieldnames=[*PRODUCT_FIELDS, *attributes])
+            self.writer.writeheader()
+    def write(self, row):
+        """
+        **Writes a single row.**
+
+        **Args:**
+        - `row` (dict): The product fields and an `attributes` dictionary.
+        """
+        if self.fmt == "jsonl":
+            self.stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            attributes = row.pop("attributes")
+            self.writer.writerow({**row, **attributes})
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from specgenie.models import GroundTruthAttribute, GroundTruthProduct, ProductAttribute
+from ._ground_truth import FORMATS, RowWriter, detect_format, open_stream
+
+class Command(BaseCommand):
+    """
+    Streams ground truth products and their attributes to a CSV or JSONL file.
+
+    Products are read with a server-side iterator in chunks, so memory stays constant
+    regardless of the size of the catalog. The output can be read back with `import_ground_truth`.
+    """
+    help = "Exports ground truth products and attributes to a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="-", help="File to write, or '-' for stdout.")
+        parser.add_argument("--format", choices=FORMATS, help="Output format. Guessed from the file extension by default.")
+        parser.add_argument("--category", type=int, help="Only export the products of this category ID.")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Number of products fetched per query.")
+
+    def handle(self, *args, **options):
+        fmt = detect_format(options["path"], options["format"])
+        products = GroundTruthProduct.objects.select_related("category").prefetch_related(
+            Prefetch("productattribute_set", queryset=ProductAttribute.objects.select_related("attribute").order_by("id"))
+        ).order_by("id")
+        attributes = GroundTruthAttribute.objects.order_by("name")
+        if options["category"] is not None:
+            products = products.filter(category_id=options["category"])
+            attributes = attributes.filter(category_id=options["category"])
+
+        stream = open_stream(options["path"], "w")
+        try:
+            writer = RowWriter(stream, fmt, dict.fromkeys(attributes.values_list("name", flat=True)))
+            for product in products.iterator(chunk_size=options["chunk_size"]):
+                writer.write({
+                    "category": product.category.name,
+                    "name": product.name,
+                    "brand": product.brand,
+                    "part_number": product.part_number,
+                    "description": product.description,
+                    "attributes": {attribute.attribute.name: attribute.value for attribute in product.productattribute_set.all()},
+                })
+        finally:
+            if options["path"] != "-":
+                stream.close()
@@ -0,0 +1,127 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from specgenie.models import Category, GroundTruthAttribute, GroundTruthProduct, ProductAttribute
+from ._ground_truth import FORMATS, detect_format, open_stream, read_rows
+
+class Command(BaseCommand):
+    """
+    Streams ground truth products from a CSV or JSONL file into the database.
+
+    Rows are written in batches with `bulk_create`/`bulk_update`, one transaction per batch.
+    Products are upserted on (brand, part_number) and their attributes on (product, attribute),
+    while missing categories and attributes are created on the fly. Updates only change the fields
+    present and not empty in the row, and new products need at least their category and name.
+    """
+    help = "Imports ground truth products and attributes from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, or '-' for stdin.")
+        parser.add_argument("--format", choices=FORMATS, help="Input format. Guessed from the file extension by default.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Number of products written per transaction.")
+
+    def handle(self, *args, **options):
+        fmt = detect_format(options["path"], options["format"])
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be a positive integer.")
+        self.categories = {category.name: category.id for category in Category.objects.all()}
+        self.attributes = {}
+        created = updated = 0
+
+        stream = open_stream(options["path"], "r")
+        try:
+            rows = read_rows(stream, fmt)
+            while batch := list(islice(rows, batch_size)):
+                batch_created, batch_updated = self.import_batch(batch)
+                created += batch_created
+                updated += batch_updated
+                self.stdout.write(f"{created + updated} products imported...", ending="\r")
+        except (KeyError, ValueError) as e:
+            raise CommandError(f"Invalid ground truth row: {e}")
+        finally:
+            if options["path"] != "-":
+                stream.close()
+        self.stdout.write(self.style.SUCCESS(f"{created} products created, {updated} products updated."))
+
+    def get_category_id(self, name):
+        """
+        **Returns the ID of a category, creating it if needed.**
+        """
+        if name not in self.categories:
+            self.categories[name] = Category.objects.create(name=name).id
+        return self.categories[name]
+
+    def get_attribute_ids(self, category_id, names):
+        """
+        **Returns a mapping from attribute name to ID for a category, creating the missing ones in bulk.**
+        """
+        if category_id not in self.attributes:
+            self.attributes[category_id] = dict(
+                GroundTruthAttribute.objects.filter(category_id=category_id).values_list("name", "id")
+            )
+        known = self.attributes[category_id]
+        missing = [GroundTruthAttribute(category_id=category_id, name=name) for name in dict.fromkeys(names) if name not in known]
+        for attribute in GroundTruthAttribute.objects.bulk_create(missing):
+            known[attribute.name] = attribute.id
+        return known
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        """
+        **Upserts a batch of rows and returns the number of created and updated products.**
+        """
+        # Last row wins when a key is repeated inside the batch
+        rows = {(row["brand"], row["part_number"]): row for row in batch}
+        brands = {brand for brand, _ in rows}
+        part_numbers = {part_number for _, part_number in rows}
+        existing = {}
+        for product in GroundTruthProduct.objects.filter(brand__in=brands, part_number__in=part_numbers).order_by("-id"):
+            existing[(product.brand, product.part_number)] = product
+
+        to_create, to_update, fields = [], [], set()
+        for key, row in rows.items():
+            product = existing.get(key)
+            if product is None:
+                if not row.get("category") or not row.get("name"):
+                    raise ValueError(f"the new product {key[0]} {key[1]} needs a category and a name")
+                product = GroundTruthProduct(brand=key[0], part_number=key[1], category_id=self.get_category_id(row["category"]), name=row["name"])
+                to_create.append(product)
+            else:
+                to_update.append(product)
+                # Empty values are treated as missing, never blanking the stored ones
+                if row.get("category"):
+                    product.category_id = self.get_category_id(row["category"])
+                    fields.add("category")
+                if row.get("name"):
+                    product.name = row["name"]
+                    fields.add("name")
+            if "description" in row:
+                product.description = row["description"] or ""
+                fields.add("description")
+        if fields:
+            # Products without some of the fields write back the value they were loaded with
+            GroundTruthProduct.objects.bulk_update(to_update, sorted(fields))
+        GroundTruthProduct.objects.bulk_create(to_create)
+        products = {(product.brand, product.part_number): product for product in to_update + to_create}
+
+        current = {
+            (attribute.product_id, attribute.attribute_id): attribute
+            for attribute in ProductAttribute.objects.filter(product__in=to_update)
+        }
+        attributes_to_create, attributes_to_update = [], []
+        for key, row in rows.items():
+            product = products[key]
+            attribute_ids = self.get_attribute_ids(product.category_id, row["attributes"].keys())
+            for name, value in row["attributes"].items():
+                attribute = current.get((product.id, attribute_ids[name]))
+                if attribute is None:
+                    attributes_to_create.append(ProductAttribute(product=product, attribute_id=attribute_ids[name], value=value))
+                elif attribute.value != value:
+                    attribute.value = value
+                    attributes_to_update.append(attribute)
+        ProductAttribute.objects.bulk_update(attributes_to_update, ["value"])
+        ProductAttribute.objects.bulk_create(attributes_to_create)
+        return len(to_create), len(to_update)
@@ -0,0 +1,66 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from backend.enums import LLMEnum, SearchEnum
+from backend.scripts import Deadline, get_ground_truth, get_model, search_google
+from specgenie.models import Category, SearchContext
+
+class Command(BaseCommand):
+    """
+    Precomputes the Google search context of every ground truth product in a category.
+
+    Searches run in a thread pool, each worker with its own LLM client for token counting,
+    and the resulting prompts are stored as `SearchContext` rows. The `/test` and `/get_sheets`
+    endpoints read them back with `stored_context=true`, which skips the live search entirely.
+    """
+    help = "Searches and stores the context prompt of every ground truth product in a category."
+
+    def add_arguments(self, parser):
+        parser.add_argument("category", type=int, nargs="+", help="ID of the categories to prewarm.")
+        parser.add_argument("--llm", choices=[llm.value for llm in LLMEnum], default=LLMEnum.CHATGPT.value, help="LLM whose token limits the contexts are sized for.")
+        parser.add_argument("--workers", type=int, default=4, help="Number of parallel searches.")
+        parser.add_argument("--budget", type=float, default=settings.SEARCH_TIME_BUDGET, help="Seconds the search of each product can take.")
+        parser.add_argument("--refresh", action="store_true", help="Search again the products that already have a stored context.")
+
+    def handle(self, *args, **options):
+        llm = LLMEnum(options["llm"])
+        queries = []
+        for category in options["category"]:
+            if not Category.objects.filter(id=category).exists():
+                raise CommandError(f"Category {category} does not exist.")
+            queries += [query for query, _ in get_ground_truth(category)]
+        if not options["refresh"]:
+            stored = set(SearchContext.objects.filter(llm=llm.value, query__in=queries).values_list("query", flat=True))
+            queries = [query for query in queries if query not in stored]
+
+        local = threading.local()
+        def search(query):
+            try:
+                if not hasattr(local, "model"):
+                    local.model = get_model(llm)
+                prompt, outcome = search_google(query, local.model, Deadline(options["budget"]))
+                if outcome not in (SearchEnum.CONTEXT, SearchEnum.PARTIAL):
+                    raise ValueError(f"No context found ({outcome.value}).")
+                return prompt, local.model.count_tokens(prompt)
+            finally:
+                # Each thread opens its own database connection
+                connection.close()
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = {executor.submit(search, query): query for query in dict.fromkeys(queries)}
+            for future in as_completed(futures):
+                query = futures[future]
+                try:
+                    prompt, tokens = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{query}: {e!r}")
+                    continue
+                SearchContext.objects.update_or_create(query=query, llm=llm.value, defaults={"prompt": prompt, "tokens": tokens})
+                self.stdout.write(f"{query}: {tokens} tokens")
+        self.stdout.write(self.style.SUCCESS(f"{len(futures) - failed} contexts stored, {failed} failed."))
@@ -0,0 +1,183 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.enums import LLMEnum, LangEnum, SearchEnum
+
+# Search outcomes of the products a live search was possible for
+SEARCHABLE_OUTCOMES = (SearchEnum.NOT_NEEDED, SearchEnum.CONTEXT, SearchEnum.PARTIAL, SearchEnum.NO_CONTEXT, SearchEnum.TIMEOUT)
+
+# Workers are spawned, so this module must stay importable before `django.setup()`:
+# everything touching the models or the LLM clients is imported inside the functions.
+
+def init_worker(rate_limit_states):
+    """
+    **Sets up Django and the shared provider rate limits in a worker process.**
+
+    **Args:**
+    - `rate_limit_states` (dict): The shared state and lock of each provider's rate limiter, keyed by LLM.
+    """
+    import django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    django.setup()
+    from backend.scripts import RATE_LIMIT_STATES
+    for llm, state in rate_limit_states.items():
+        RATE_LIMIT_STATES[LLMEnum(llm)] = state
+
+def run_shard(shard, options, output):
+    """
+    **Evaluates one (category, prompt version, model) shard, writing every row as soon as it is ready.**
+
+    **Args:**
+    - `shard` (tuple): The category ID, prompt version and LLM of the shard.
+    - `options` (dict): The command options shared by every shard.
+    - `output` (Path): The directory the results are written to.
+
+    **Returns:**
+    - `dict`: A summary of the shard, with its number of products, skipped products, average similarity score and verdict counts.
+    """
+    from backend.renderers import rows_to_jsonl
+    from backend.scripts import Deadline, run_test
+    category, version, llm = shard
+    summary = {"category": category, "version": version, "llm": llm, "products": 0, "skipped": 0, "scored": 0, "average_score": None, "verdicts": {}, "searches": {}, "tiers": {}, "error": None}
+    scores, verdicts, searches, tiers, latencies = [], Counter(), Counter(), Counter(), Counter()
+    start = time.time()
+    with open(output / f"{category}-v{version}-{llm}.jsonl", "w", encoding="utf-8") as results:
+        try:
+            rows = run_test(
+                LLMEnum(llm), LLMEnum(options["judge"]), LLMEnum(options["copywriter"]), category,
+                options["google_search"], options["stored_context"], options["lang"], options["number"], version,
+                LLMEnum(options["cascade"]) if options["cascade"] else None, options["adaptive_search"],
+                Deadline(options["budget"]),
+            )
+            for row in rows:
+                results.write(rows_to_jsonl([row]))
+                results.flush()
+                summary["products"] += 1
+                if row.similarity_score.score is not None:
+                    scores.append(row.similarity_score.score)
+                verdicts[row.similarity_score.veredict] += 1
+                searches[row.search.value] += 1
+                if row.tier is not None:
+                    tiers[row.tier.value] += 1
+                    latencies[row.tier.value] += row.latency
+        except Exception as e:
+            summary["error"] = repr(e)
+    if scores:
+        summary["scored"] = len(scores)
+        summary["average_score"] = sum(scores)/len(scores)
+    summary["verdicts"] = {str(verdict): count for verdict, count in verdicts.items()}
+    summary["searches"] = dict(searches)
+    summary["skipped"] = searches[SearchEnum.SKIPPED.value]
+    summary["tiers"] = {tier: {"products": count, "average_latency": latencies[tier]/count} for tier, count in tiers.items()}
+    summary["seconds"] = time.time() - start
+    return summary
+
+class Command(BaseCommand):
+    """
+    Runs the `/test` evaluation over every combination of category, prompt version and model.
+
+    Each combination is a shard evaluated in its own process. Shards share the tokens per minute
+    limit of each provider through a multiprocessing manager, write their rows to a JSONL file as
+    they go, and are merged into a `summary.json` report (and optionally a Parquet file) at the end.
+    """
+    help = "Evaluates spec sheet generation over categories, prompt versions and models in parallel."
+
+    def add_arguments(self, parser):
+        llms = [llm.value for llm in LLMEnum]
+        parser.add_argument("--category", type=int, nargs="+", help="ID of the categories to evaluate. Defaults to every category.")
+        parser.add_argument("--llm", nargs="+", choices=llms, default=[LLMEnum.CHATGPT.value], help="LLMs used to generate the spec sheets.")
+        # Not --version, which every management command already has
+        parser.add_argument("--versions", dest="version", type=int, nargs="+", default=[2], help="Versions of the Maker prompt.")
+        parser.add_argument("--number", type=int, default=4, help="Number of the Maker prompt.")
+        parser.add_argument("--judge", choices=llms, default=LLMEnum.CHATGPT.value, help="LLM used to evaluate the spec sheets.")
+        parser.add_argument("--copywriter", choices=llms, default=LLMEnum.CHATGPT.value, help="LLM used to generate the descriptions.")
+        parser.add_argument("--cascade", choices=llms, help="Cheaper LLM that generates the spec sheets first, escalating to --llm on low confidence.")
+        parser.add_argument("--lang", choices=[lang.value for lang in LangEnum], default=LangEnum.ENGLISH.value, help="Language of the copywriter.")
+        parser.add_argument("--no-google-search", dest="google_search", action="store_false", help="Do not search Google for context.")
+        parser.add_argument("--adaptive-search", action="store_true", help="Only search Google when the Maker cannot answer confidently without context.")
+        parser.add_argument("--stored-context", action="store_true", help="Use the contexts stored by prewarm_contexts.")
+        parser.add_argument("--budget", type=float, help="Seconds each shard can take, after which its remaining products are skipped. Unlimited by default.")
+        parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Number of worker processes. With 1, the shards run one after another in this process.")
+        parser.add_argument("--parquet", action="store_true", help="Also merge every row into a results.parquet file. Requires pyarrow.")
+        parser.add_argument("--output", help="Directory for the results. Defaults to eval_results/<timestamp>.")
+
+    def handle(self, *args, **options):
+        from specgenie.models import Category
+
+        categories = options["category"] or list(Category.objects.order_by("id").values_list("id", flat=True))
+        if not categories:
+            raise CommandError("There are no categories to evaluate.")
+        output = Path(options["output"] or Path("eval_results") / time.strftime("%Y%m%d-%H%M%S"))
+        output.mkdir(parents=True, exist_ok=True)
+        shards = list(product(categories, options["version"], options["llm"]))
+        shard_options = {key: options[key] for key in ("judge", "copywriter", "lang", "google_search", "stored_context", "number", "cascade", "adaptive_search", "budget")}
+
+        summaries = []
+        if options["processes"] == 1:
+            for shard in shards:
+                self.report_shard(run_shard(shard, shard_options, output), summaries)
+        else:
+            context = multiprocessing.get_context("spawn")
+            with context.Manager() as manager:
+                rate_limit_states = {llm: (manager.dict(), manager.Lock()) for llm in {*options["llm"], options["judge"], options["copywriter"], options["cascade"]} - {None}}
+
+                with ProcessPoolExecutor(max_workers=options["processes"], mp_context=context, initializer=init_worker, initargs=(rate_limit_states,)) as executor:
+                    futures = [executor.submit(run_shard, shard, shard_options, output) for shard in shards]
+                    for future in as_completed(futures):
+                        self.report_shard(future.result(), summaries)
+
+        summaries.sort(key=lambda summary: (summary["category"], summary["version"], summary["llm"]))
+        verdicts, searches, tiers, latencies = Counter(), Counter(), Counter(), Counter()
+        for summary in summaries:
+            verdicts.update(summary["verdicts"])
+            searches.update(summary["searches"])
+            for tier, stats in summary["tiers"].items():
+                tiers[tier] += stats["products"]
+                latencies[tier] += stats["average_latency"]*stats["products"]
+        scored = sum(summary["scored"] for summary in summaries)
+        report = {
+            "shards": summaries,
+            "products": sum(summary["products"] for summary in summaries),
+            "average_score": sum(summary["average_score"]*summary["scored"] for summary in summaries if summary["scored"])/scored if scored else None,
+            "verdicts": dict(verdicts),
+            "searches": dict(searches),
+            # Out of the products that could be searched, so neither skipped nor with search disabled or stored
+            "answered_without_search": searches[SearchEnum.NOT_NEEDED.value]/max(sum(searches[outcome.value] for outcome in SEARCHABLE_OUTCOMES), 1),
+            "tiers": {tier: {"products": count, "average_latency": latencies[tier]/count} for tier, count in tiers.items()},
+            "failed_shards": sum(1 for summary in summaries if summary["error"]),
+            # Their average score only covers the products evaluated before the budget ran out
+            "incomplete_shards": sum(1 for summary in summaries if summary["skipped"]),
+        }
+        if options["parquet"]:
+            from backend.renderers import rows_to_parquet
+            from backend.schemas import EvaluationRow
+            rows = []
+            for summary in summaries:
+                with open(output / f"{summary['category']}-v{summary['version']}-{summary['llm']}.jsonl", encoding="utf-8") as results:
+                    rows += [EvaluationRow.model_validate_json(line) for line in results]
+            (output / "results.parquet").write_bytes(rows_to_parquet(rows))
+        with open(output / "summary.json", "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"{report['products']} products evaluated in {len(shards)} shards, summary written to {output / 'summary.json'}"))
+
+    def report_shard(self, summary, summaries):
+        """
+        **Collects the summary of a finished shard and writes its status.**
+
+        **Args:**
+        - `summary` (dict): The summary returned by `run_shard`.
+        - `summaries` (list): The summaries of the shards finished so far.
+        """
+        summaries.append(summary)
+        status = summary["error"] or f"{summary['products']} products, average score {summary['average_score']}"
+        if summary["skipped"]:
+            status += f", incomplete: {summary['skipped']} products skipped"
+        self.stdout.write(f"Category {summary['category']} v{summary['version']} {summary['llm']}: {status}")
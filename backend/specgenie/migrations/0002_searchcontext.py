@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('specgenie', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchContext',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=200)),
+                ('llm', models.CharField(max_length=20)),
+                ('prompt', models.TextField()),
+                ('tokens', models.IntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('query', 'llm'), name='unique_search_context')],
+            },
+        ),
+    ]
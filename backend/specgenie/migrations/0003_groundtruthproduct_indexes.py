@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:38
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('specgenie', '0002_searchcontext'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='groundtruthproduct',
+            constraint=models.UniqueConstraint(fields=('brand', 'part_number'), name='unique_ground_truth_product'),
+        ),
+        migrations.AddIndex(
+            model_name='groundtruthproduct',
+            index=models.Index(django.db.models.functions.text.Upper('brand'), name='product_upper_brand'),
+        ),
+        migrations.AddIndex(
+            model_name='groundtruthproduct',
+            index=models.Index(django.db.models.functions.text.Upper('part_number'), name='product_upper_part_number'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('specgenie', '0003_groundtruthproduct_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FetchedPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=1000, unique=True)),
+                ('text', models.TextField()),
+                ('fingerprint', models.CharField(max_length=16)),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UselessPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=200)),
+                ('url', models.URLField(max_length=1000)),
+                ('reason', models.CharField(max_length=20)),
+                ('fingerprint', models.CharField(blank=True, max_length=16)),
+                ('max_tokens', models.IntegerField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('query', 'url'), name='unique_useless_page')],
+            },
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Upper
 
 class Category(models.Model):
     """
@@ -102,6 +103,16 @@ class GroundTruthProduct(models.Model):
     brand = models.CharField(max_length=100)
     part_number = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    class Meta:
+        constraints = [
+            # Also the index of the searches by brand, and the key of import_ground_truth
+            models.UniqueConstraint(fields=["brand", "part_number"], name="unique_ground_truth_product"),
+        ]
+        indexes = [
+            # The case-insensitive prefix searches of the admin
+            models.Index(Upper("brand"), name="product_upper_brand"),
+            models.Index(Upper("part_number"), name="product_upper_part_number"),
+        ]
     def __str__(self):
         return f"{self.category} - {self.name}"
     def to_json(self):
@@ -128,4 +139,76 @@ class ProductAttribute(models.Model):
     attribute = models.ForeignKey(GroundTruthAttribute, on_delete=models.CASCADE)
     value = models.CharField(max_length=100)
     def __str__(self):
-        return f"{self.product.category} - {self.attribute.name} - {self.product.name}"
\ No newline at end of file
+        return f"{self.product.category} - {self.attribute.name} - {self.product.name}"
+
+class SearchContext(models.Model):
+    """
+    Represents a precomputed search context for a product query.
+
+    **Attributes:**
+    - `query` (CharField): The product query the context was searched for.
+    - `llm` (CharField): The LLM whose token limits the context was sized for.
+    - `prompt` (TextField): The final prompt, including the context and the product query.
+    - `tokens` (IntegerField): The number of tokens in the prompt.
+    - `updated_at` (DateTimeField): When the context was last computed.
+
+    **Methods:**
+    - `__str__()`: Returns a string representation of the search context.
+    """
+    query = models.CharField(max_length=200)
+    llm = models.CharField(max_length=20)
+    prompt = models.TextField()
+    tokens = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["query", "llm"], name="unique_search_context"),
+        ]
+    def __str__(self):
+        return f"{self.llm} - {self.query}"
+
+class FetchedPage(models.Model):
+    """
+    Represents the text extracted from a page of the search results, so it is not fetched again.
+
+    **Attributes:**
+    - `url` (URLField): The URL of the page.
+    - `text` (TextField): The text extracted from the page.
+    - `fingerprint` (CharField): The 64-bit simhash of the text, in hexadecimal, used to detect near-duplicate pages.
+    - `fetched_at` (DateTimeField): When the page was last fetched.
+
+    **Methods:**
+    - `__str__()`: Returns the URL of the page.
+    """
+    url = models.URLField(max_length=1000, unique=True)
+    text = models.TextField()
+    fingerprint = models.CharField(max_length=16)
+    fetched_at = models.DateTimeField(auto_now=True)
+    def __str__(self):
+        return self.url
+
+class UselessPage(models.Model):
+    """
+    Represents a page of the search results of a product query that cannot be used as its context.
+
+    **Attributes:**
+    - `query` (CharField): The product query.
+    - `url` (URLField): The URL of the page.
+    - `reason` (CharField): Why the page is useless: "not_html", "no_text", "too_long" or "duplicate" (of a page too long).
+    - `fingerprint` (CharField): The simhash of the text of the page, or empty if it has no text.
+    - `max_tokens` (IntegerField): The token limit of the model it was found useless for, or the largest integer if it is useless for every model. Models with a higher limit fetch it again.
+
+    **Methods:**
+    - `__str__()`: Returns a string representation of the useless page.
+    """
+    query = models.CharField(max_length=200)
+    url = models.URLField(max_length=1000)
+    reason = models.CharField(max_length=20)
+    fingerprint = models.CharField(max_length=16, blank=True)
+    max_tokens = models.IntegerField()
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["query", "url"], name="unique_useless_page"),
+        ]
+    def __str__(self):
+        return f"{self.query} - {self.url} ({self.reason})"
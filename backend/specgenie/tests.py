@@ -1,3 +1,915 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from specgenie.models import Category, FetchedPage, GroundTruthAttribute, GroundTruthProduct, Prompt, PromptLang, PromptRole, ProductAttribute, SearchContext, UselessPage
+from unittest import mock
+import io, json, os, random, subprocess, sys, tempfile, threading, time
 
-# Create your tests here.
+class ImportTimeTests(SimpleTestCase):
+    """
+    Guards the startup time of the API, management commands and evaluation workers.
+
+    Importing the API must not pull in any provider SDK or other heavy dependency,
+    as they are only needed once a model is created or a page is fetched.
+    """
+    HEAVY_MODULES = ("google.generativeai", "openai", "tiktoken", "bs4", "thefuzz", "requests", "pandas", "pyarrow")
+    MAX_IMPORT_SECONDS = 5
+
+    def import_times(self, statement):
+        """
+        **Imports modules in a fresh interpreter and returns the cumulative import time of each module in seconds.**
+        """
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import django; django.setup(); {statement}"],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": "backend.settings"},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times = {}
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and not line.endswith("imported package"):
+                _, cumulative, module = line[len("import time:"):].split("|")
+                times[module.strip()] = int(cumulative) / 1e6
+        return times
+
+    def test_api_does_not_import_heavy_dependencies(self):
+        times = self.import_times("import backend.api")
+        for module in self.HEAVY_MODULES:
+            self.assertNotIn(module, times, f"{module} is imported at startup")
+        self.assertLess(times["backend.api"], self.MAX_IMPORT_SECONDS)
+
+    def test_management_commands_do_not_import_heavy_dependencies(self):
+        times = self.import_times(
+            "import specgenie.management.commands.prewarm_contexts, specgenie.management.commands.run_eval"
+        )
+        for module in self.HEAVY_MODULES:
+            self.assertNotIn(module, times, f"{module} is imported at startup")
+
+class StandInLLMHandler(BaseHTTPRequestHandler):
+    """
+    Answers chat completions like an OpenAI-compatible server, echoing the last message after a short delay.
+    """
+    delay = 0.2
+    answer = None
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def do_POST(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            time.sleep(self.delay)
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            messages = body["messages"]
+            answer = self.answer or f"echo: {messages[-1]['content']}"
+            self.reply({
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10 * len(messages), "completion_tokens": 7, "total_tokens": 10 * len(messages) + 7},
+            })
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def do_GET(self):
+        self.reply({"object": "list", "data": [{"id": "stand-in", "object": "model"}]})
+
+    def reply(self, data):
+        content = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+class LocalLLMTests(SimpleTestCase):
+    """
+    Runs the self-hosted provider against a local stand-in for an OpenAI-compatible server.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInLLMHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.enterClassContext(override_settings(
+            LOCAL_LLM_BASE_URL=f"http://127.0.0.1:{cls.server.server_port}/v1",
+            LOCAL_LLM_MODEL="",
+            LOCAL_LLM_CONCURRENCY=8,
+            LOCAL_LLM_MAX_TOKENS=50,
+        ))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        from backend.enums import LLMEnum
+        from backend.scripts import get_model
+        StandInLLMHandler.max_active = 0
+        self.model = get_model(LLMEnum.LOCAL)
+        self.model.start_chat("You are a test.")
+
+    def test_uses_the_first_served_model(self):
+        self.assertEqual(self.model.model, "stand-in")
+
+    def test_send_message_accounts_reported_usage(self):
+        self.assertEqual(self.model.send_message("hello"), "echo: hello")
+        # 20 prompt tokens for the system prompt and the message, 7 for the answer
+        self.assertEqual(self.model.tokens, 27)
+        self.assertEqual([record["role"] for record in self.model.history], ["system", "user", "assistant"])
+
+    def test_history_is_trimmed_to_the_token_window(self):
+        for i in range(5):
+            self.model.send_message(f"message {i}")
+        self.assertEqual(self.model.history[0]["content"], "You are a test.")
+        self.assertEqual(self.model.history[-2]["content"], "message 4")
+        self.assertLess(self.model.tokens, 50)
+
+    def test_send_batch_sends_concurrently_in_order(self):
+        messages = [f"product {i}" for i in range(16)]
+        start = time.monotonic()
+        responses = self.model.send_batch(messages)
+        self.assertEqual(responses, [f"echo: {message}" for message in messages])
+        self.assertGreater(StandInLLMHandler.max_active, 1)
+        self.assertLess(time.monotonic() - start, 16 * StandInLLMHandler.delay)
+        self.assertEqual(len(self.model.history), 1)
+
+class StandInMakerHandler(StandInLLMHandler):
+    """
+    Answers every chat completion with the same spec sheet.
+    """
+    delay = 0
+    answer = json.dumps({"RAM": "16 GB"})
+
+class RunEvalTests(TestCase):
+    """
+    Runs the `run_eval` command in-process against a local stand-in for every LLM.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInMakerHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.enterClassContext(override_settings(
+            LOCAL_LLM_BASE_URL=f"http://127.0.0.1:{cls.server.server_port}/v1",
+            LOCAL_LLM_MODEL="stand-in",
+        ))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.category = Category.objects.create(name="Laptops")
+        lang = PromptLang.objects.create(name="en")
+        for role, number, versions in (("Maker", 4, (1, 2)), ("Judge", 1, (1,)), ("Copywriter", 1, (1,))):
+            role = PromptRole.objects.create(name=role)
+            for version in versions:
+                Prompt.objects.create(category=self.category, role=role, lang=lang, number=number, version=version, content=f"{role} prompt")
+        ram = GroundTruthAttribute.objects.create(category=self.category, name="RAM")
+        for part_number, value in (("20XW", "16 GB"), ("82A1", "32 GB")):
+            product = GroundTruthProduct.objects.create(category=self.category, name=part_number, brand="Lenovo", part_number=part_number)
+            ProductAttribute.objects.create(product=product, attribute=ram, value=value)
+
+    def test_run_eval_writes_every_shard_and_the_summary(self):
+        output = Path(self.directory.name)
+        call_command(
+            "run_eval", "--category", str(self.category.id), "--llm", "local", "--judge", "local", "--copywriter", "local",
+            "--versions", "1", "2", "--no-google-search", "--processes", "1", "--output", str(output), stdout=io.StringIO())
+        for version in (1, 2):
+            lines = (output / f"{self.category.id}-v{version}-local.jsonl").read_text(encoding="utf-8").splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertEqual({json.loads(line)["spec_sheet"]["RAM"] for line in lines}, {"16 GB"})
+        summary = json.loads((output / "summary.json").read_text(encoding="utf-8"))
+        self.assertEqual(len(summary["shards"]), 2)
+        self.assertEqual(summary["products"], 4)
+        self.assertEqual(summary["verdicts"], {"Correct": 2, "Inconsistencies found": 2})
+        self.assertEqual(summary["searches"], {"disabled": 4})
+        self.assertEqual(summary["tiers"]["single"]["products"], 4)
+        self.assertEqual((summary["failed_shards"], summary["incomplete_shards"]), (0, 0))
+
+class GroundTruthImportExportTests(TestCase):
+    """
+    Round trips ground truth products through the `import_ground_truth` and `export_ground_truth` commands.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = Path(self.directory.name) / name
+        path.write_text(content, encoding="utf-8")
+        return str(path)
+
+    def import_file(self, name, content):
+        call_command("import_ground_truth", self.write(name, content), stdout=io.StringIO())
+
+    def attributes(self, product):
+        return dict(ProductAttribute.objects.filter(product=product).values_list("attribute__name", "value"))
+
+    def test_csv_import_creates_categories_products_and_attributes(self):
+        self.import_file("products.csv", "category,name,brand,part_number,description,RAM,Storage\nLaptops,X1,Lenovo,20XW,Light,16 GB,\n")
+        product = GroundTruthProduct.objects.get(brand="Lenovo", part_number="20XW")
+        self.assertEqual(product.category.name, "Laptops")
+        self.assertEqual(product.description, "Light")
+        self.assertEqual(self.attributes(product), {"RAM": "16 GB"})
+
+    def test_update_only_changes_the_fields_in_the_row(self):
+        self.import_file("products.jsonl", json.dumps({"category": "Laptops", "name": "X1", "brand": "Lenovo", "part_number": "20XW", "description": "Light", "attributes": {"RAM": "16 GB"}}))
+        self.import_file("update.jsonl", json.dumps({"brand": "Lenovo", "part_number": "20XW", "name": "X1 Carbon", "attributes": {"RAM": "32 GB"}}))
+        product = GroundTruthProduct.objects.get()
+        self.assertEqual((product.name, product.description, product.category.name), ("X1 Carbon", "Light", "Laptops"))
+        self.assertEqual(self.attributes(product), {"RAM": "32 GB"})
+
+    def test_empty_csv_cells_keep_the_stored_fields(self):
+        self.import_file("products.csv", "category,name,brand,part_number,description,RAM\nLaptops,X1,Lenovo,20XW,Light,16 GB\n")
+        self.import_file("update.csv", "category,name,brand,part_number,description,RAM\n,,Lenovo,20XW,,32 GB\n")
+        product = GroundTruthProduct.objects.get()
+        self.assertEqual((product.name, product.description, product.category.name), ("X1", "Light", "Laptops"))
+        self.assertEqual(self.attributes(product), {"RAM": "32 GB"})
+        self.assertEqual(list(Category.objects.values_list("name", flat=True)), ["Laptops"])
+
+    def test_new_products_without_category_or_name_are_reported(self):
+        for content in ("category,name,brand,part_number\n,X1,Lenovo,20XW\n", "category,name,brand,part_number\nLaptops,,Lenovo,20XW\n"):
+            with self.assertRaisesMessage(CommandError, "needs a category and a name"):
+                self.import_file("products.csv", content)
+        with self.assertRaisesMessage(CommandError, "needs a category and a name"):
+            self.import_file("products.jsonl", json.dumps({"category": "", "name": "X1", "brand": "Lenovo", "part_number": "20XW"}))
+        self.assertFalse(GroundTruthProduct.objects.exists())
+        self.assertFalse(Category.objects.exists())
+
+    def test_invalid_attributes_are_reported(self):
+        with self.assertRaisesMessage(CommandError, "Invalid ground truth row"):
+            self.import_file("products.jsonl", json.dumps({"category": "Laptops", "name": "X1", "brand": "Lenovo", "part_number": "20XW", "attributes": None}))
+        self.assertFalse(GroundTruthProduct.objects.exists())
+
+    def test_export_and_import_round_trip(self):
+        self.import_file("products.jsonl", "\n".join(json.dumps(row) for row in [
+            {"category": "Laptops", "name": "X1", "brand": "Lenovo", "part_number": "20XW", "description": "Light", "attributes": {"RAM": "16 GB", "Storage": "1 TB"}},
+            {"category": "Monitors", "name": "27G2", "brand": "AOC", "part_number": "27G2U", "description": "", "attributes": {"Screen Size": "27 in"}},
+        ]))
+        for fmt in ("csv", "jsonl"):
+            path = str(Path(self.directory.name) / f"export.{fmt}")
+            call_command("export_ground_truth", path, "--category", str(Category.objects.get(name="Laptops").id))
+            exported = {(product.brand, product.part_number): (product.name, product.description, self.attributes(product)) for product in GroundTruthProduct.objects.all()}
+            GroundTruthProduct.objects.all().delete()
+            call_command("import_ground_truth", path, stdout=io.StringIO())
+            imported = {(product.brand, product.part_number): (product.name, product.description, self.attributes(product)) for product in GroundTruthProduct.objects.all()}
+            self.assertEqual(imported, {("Lenovo", "20XW"): exported[("Lenovo", "20XW")]})
+
+class StoredContextTests(TestCase):
+    """
+    Stores search contexts with the `prewarm_contexts` command, with the Google search mocked, and reads them back.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(name="Laptops")
+        for part_number in ("20XW", "82A1", "X515"):
+            GroundTruthProduct.objects.create(category=self.category, name=part_number, brand="Lenovo", part_number=part_number)
+        self.searched = []
+
+    def search_google(self, product, model, deadline=None, max_pages=None):
+        from backend.enums import SearchEnum
+        self.searched.append(product)
+        if product == "Lenovo X515":
+            return product, SearchEnum.NO_CONTEXT
+        return f"<context>{product}</context>\n{product}", SearchEnum.CONTEXT
+
+    def prewarm(self, *args):
+        model = mock.Mock(count_tokens=lambda prompt: len(prompt.split()))
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch("specgenie.management.commands.prewarm_contexts.search_google", self.search_google), \
+                mock.patch("specgenie.management.commands.prewarm_contexts.get_model", return_value=model):
+            call_command("prewarm_contexts", str(self.category.id), "--llm", "local", *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_prewarm_stores_the_contexts_found(self):
+        stdout, stderr = self.prewarm()
+        self.assertEqual(sorted(self.searched), ["Lenovo 20XW", "Lenovo 82A1", "Lenovo X515"])
+        self.assertEqual(dict(SearchContext.objects.values_list("query", "tokens")), {"Lenovo 20XW": 4, "Lenovo 82A1": 4})
+        self.assertIn("2 contexts stored, 1 failed.", stdout)
+        self.assertIn("Lenovo X515", stderr)
+
+        # Stored contexts are only searched again with --refresh
+        self.searched = []
+        self.prewarm()
+        self.assertEqual(self.searched, ["Lenovo X515"])
+        self.searched = []
+        self.prewarm("--refresh")
+        self.assertEqual(len(self.searched), 3)
+
+    def test_get_product_prompt_reads_the_stored_context(self):
+        from backend.enums import LLMEnum, SearchEnum
+        from backend.scripts import get_product_prompt
+        self.prewarm()
+        with mock.patch("backend.scripts.search_google") as search_google:
+            self.assertEqual(
+                get_product_prompt("Lenovo 20XW", None, LLMEnum.LOCAL, stored_context=True),
+                ("<context>Lenovo 20XW</context>\nLenovo 20XW", SearchEnum.STORED))
+            self.assertEqual(get_product_prompt("Lenovo X515", None, LLMEnum.LOCAL, stored_context=True), ("Lenovo X515", SearchEnum.NO_CONTEXT))
+            # Contexts are stored per LLM
+            self.assertEqual(get_product_prompt("Lenovo 20XW", None, LLMEnum.CHATGPT, stored_context=True), ("Lenovo 20XW", SearchEnum.NO_CONTEXT))
+        search_google.assert_not_called()
+
+class SearchBudgetTests(TestCase):
+    """
+    Covers the bounds of the Google search and the products skipped when the request budget runs out,
+    with the Custom Search API always returning more results.
+    """
+    def setUp(self):
+        self.searches = []
+
+    def search(self, fetch_cached_page, deadline=None, max_pages=None):
+        from backend.scripts import search_google
+        def fake_get(url, params, **kwargs):
+            self.searches.append(params["start"])
+            return mock.Mock(json=lambda: {"items": [{"link": f"https://example.com/{params['start']}/{i}"} for i in range(10)]})
+        with mock.patch("requests.get", fake_get), mock.patch("backend.scripts.fetch_cached_page", fetch_cached_page):
+            return search_google("Lenovo 20XW", FakeModel(), deadline, max_pages)
+
+    def test_search_stops_after_max_pages(self):
+        from backend.enums import SearchEnum
+        fetch_cached_page = mock.Mock(return_value=(None, None))
+        self.assertEqual(self.search(fetch_cached_page, max_pages=3), ("Lenovo 20XW", SearchEnum.NO_CONTEXT))
+        self.assertEqual(self.searches, [1, 11, 21])
+        self.assertEqual(fetch_cached_page.call_count, 30)
+
+    def test_expired_deadline_times_out_before_searching(self):
+        from backend.enums import SearchEnum
+        from backend.scripts import Deadline
+        fetch_cached_page = mock.Mock(return_value=(None, None))
+        self.assertEqual(self.search(fetch_cached_page, Deadline(0)), ("Lenovo 20XW", SearchEnum.TIMEOUT))
+        self.assertEqual(self.searches, [])
+        fetch_cached_page.assert_not_called()
+
+    def test_download_cut_by_the_deadline_is_partial(self):
+        from backend.enums import SearchEnum
+        from backend.scripts import DeadlineExceeded
+        prompt, outcome = self.search(mock.Mock(side_effect=DeadlineExceeded("Intel i7, 16 GB")))
+        self.assertEqual((prompt, outcome), ("<context>Intel i7, 16 GB</context>\nLenovo 20XW", SearchEnum.PARTIAL))
+        # Without any text, the search gives up
+        self.assertEqual(self.search(mock.Mock(side_effect=DeadlineExceeded())), ("Lenovo 20XW", SearchEnum.TIMEOUT))
+        self.assertFalse(UselessPage.objects.exists())
+
+    def create_products(self):
+        category = Category.objects.create(name="Laptops")
+        for part_number in ("20XW", "82A1"):
+            GroundTruthProduct.objects.create(category=category, name=part_number, brand="Lenovo", part_number=part_number)
+        return category
+
+    def test_run_test_skips_products_once_the_budget_runs_out(self):
+        from backend.enums import LLMEnum, SearchEnum
+        from backend.scripts import Deadline, run_test
+        category = self.create_products()
+        maker = FakeMaker("{}")
+        with mock.patch("backend.scripts.get_model", return_value=maker), mock.patch("backend.scripts.get_prompt", return_value="prompt"):
+            rows = list(run_test(LLMEnum.CHATGPT, LLMEnum.CHATGPT, LLMEnum.CHATGPT, category.id, google_search=False, deadline=Deadline(0)))
+        self.assertEqual([row.search for row in rows], [SearchEnum.SKIPPED] * 2)
+        self.assertEqual([row.ground_truth["name"] for row in rows], ["20XW", "82A1"])
+        self.assertEqual(maker.messages, [])
+
+    @override_settings(REQUEST_TIME_BUDGET=0)
+    def test_get_sheets_skips_products_once_the_budget_runs_out(self):
+        from backend.api import get_sheets
+        from backend.enums import LLMEnum, SearchEnum
+        category = self.create_products()
+        maker = FakeMaker("{}")
+        with mock.patch("backend.api.get_model", return_value=maker), mock.patch("backend.api.get_prompt", return_value="prompt"):
+            sheets = get_sheets(None, ["Lenovo 20XW", "Lenovo 82A1"], LLMEnum.CHATGPT, LLMEnum.CHATGPT, category.id, google_search=False)
+        self.assertEqual([(sheet.product, sheet.search) for sheet in sheets], [("Lenovo 20XW", SearchEnum.SKIPPED), ("Lenovo 82A1", SearchEnum.SKIPPED)])
+        self.assertEqual(maker.messages, [])
+
+class RateLimiterTests(SimpleTestCase):
+    def test_acquire_gives_up_when_the_deadline_is_shorter_than_the_wait(self):
+        from backend.scripts import Deadline, DeadlineExceeded, RateLimiter
+        limiter = RateLimiter(100)
+        limiter.acquire(80)
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            limiter.acquire(80, Deadline(1))
+        self.assertLess(time.monotonic() - start, 1)
+        # The lock is not held while waiting, and answers are recorded without waiting
+        limiter.record(50)
+        self.assertEqual(limiter.state["used"], 130)
+
+class RenderersTests(SimpleTestCase):
+    def test_parquet_export_keeps_every_column(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        from backend.enums import SearchEnum, TierEnum
+        from backend.renderers import rows_to_parquet
+        from backend.schemas import EvaluationRow
+        rows = [
+            EvaluationRow(spec_sheet={"RAM": "16 GB"}, ground_truth={"RAM": "16 GB"}, search=SearchEnum.CONTEXT, tier=TierEnum.ESCALATED, latency=1.5),
+            EvaluationRow(ground_truth={"RAM": "8 GB"}, search=SearchEnum.SKIPPED),
+        ]
+        table = pq.read_table(io.BytesIO(rows_to_parquet(rows)))
+        self.assertEqual(table.column("tier").to_pylist(), ["escalated", None])
+        self.assertEqual(table.column("latency").to_pylist(), [1.5, None])
+        self.assertEqual(table.column("search").to_pylist(), ["context", "skipped"])
+
+class ChatHistoryTests(SimpleTestCase):
+    """
+    Checks the token counting and trimming of the chat history of the ChatGPT and Gemini clients, with their SDKs mocked.
+    """
+    def chatgpt(self, max_tokens):
+        from backend.scripts import ChatGPTAPI, RateLimiter
+        client = object.__new__(ChatGPTAPI)
+        client.model = "gpt-4o"
+        client.client = mock.Mock()
+        client.rate_limiter = RateLimiter(10**9)
+        client.init_history(max_tokens)
+        def create(model, messages, timeout):
+            # Every message is as many tokens as words, plus one per message
+            prompt_tokens = sum(len(message["content"].split()) + 1 for message in messages)
+            return mock.Mock(
+                choices=[mock.Mock(message=mock.Mock(content="an answer"))],
+                usage=mock.Mock(prompt_tokens=prompt_tokens, completion_tokens=2))
+        client.client.chat.completions.create.side_effect = create
+        client.count_tokens = lambda prompt, deadline=None: len(prompt.split())
+        return client
+
+    def gemini(self, max_tokens):
+        from backend.scripts import GeminiAPI, RateLimiter
+        client = object.__new__(GeminiAPI)
+        client.model = mock.Mock()
+        client.rate_limiter = RateLimiter(10**9)
+        client.init_history(max_tokens)
+        client.model.count_tokens.side_effect = lambda prompt, request_options: mock.Mock(total_tokens=len(prompt.split()))
+        client.model.generate_content.return_value = mock.Mock(
+            text="ready", usage_metadata=mock.Mock(prompt_token_count=5, candidates_token_count=1))
+        def start_chat(history):
+            history_tokens = sum(len(record["parts"][0].split()) for record in history)
+            chat = mock.Mock()
+            chat.send_message.side_effect = lambda message, request_options: mock.Mock(
+                text="an answer",
+                usage_metadata=mock.Mock(prompt_token_count=history_tokens + len(message.split()), candidates_token_count=2))
+            return chat
+        client.model.start_chat.side_effect = start_chat
+        return client
+
+    def assert_tokens_match_history(self, client):
+        self.assertEqual(client.tokens, sum(record["tokens"] for record in client.history))
+
+    def test_chatgpt_counts_and_trims_the_history(self):
+        client = self.chatgpt(40)
+        client.start_chat("you write spec sheets")
+        self.assertEqual(client.tokens, 4)
+        self.assertEqual(client.send_message("one two three"), "an answer")
+        # The prompt usage also covers the starting prompt, and one token per message
+        self.assertEqual([record["tokens"] for record in client.history], [4, 5, 2])
+        for i in range(10):
+            client.send_message(f"message {i} with six words")
+            self.assert_tokens_match_history(client)
+            # Only the answer is added after trimming
+            self.assertLessEqual(client.tokens, 40 + 2)
+        self.assertEqual(client.history[0]["content"], "you write spec sheets")
+        self.assertEqual(client.history[-2]["content"], "message 9 with six words")
+        client.clear_history()
+        self.assertEqual(client.tokens, 4)
+        self.assertEqual(len(client.history), 1)
+
+    def test_gemini_counts_and_trims_the_history(self):
+        client = self.gemini(40)
+        self.assertEqual(client.start_chat("you write spec sheets"), "ready")
+        self.assertEqual(client.tokens, 6)
+        self.assertEqual(client.send_message("one two three"), "an answer")
+        self.assertEqual([record["tokens"] for record in client.history], [5, 1, 3, 2])
+        for i in range(10):
+            client.send_message(f"message {i} with six words")
+            self.assert_tokens_match_history(client)
+            # Only the answer is added after trimming
+            self.assertLessEqual(client.tokens, 40 + 2)
+        self.assertEqual(client.history[:2], [
+            {"role": "user", "content": "you write spec sheets", "tokens": 5},
+            {"role": "model", "content": "ready", "tokens": 1}])
+        self.assertEqual(client.history[-2]["content"], "message 9 with six words")
+        # Starting a new chat resets the count
+        client.start_chat("you write spec sheets")
+        self.assertEqual(client.tokens, 6)
+        self.assertEqual(len(client.history), 2)
+
+    def test_gemini_acquires_the_message_once_and_records_the_answer(self):
+        client = self.gemini(40)
+        client.start_chat("you write spec sheets")
+        client.rate_limiter = mock.Mock()
+        chat = mock.Mock()
+        chat.send_message.side_effect = [
+            RuntimeError("unavailable"),
+            mock.Mock(text="an answer", usage_metadata=mock.Mock(prompt_token_count=9, candidates_token_count=2)),
+        ]
+        client.model.start_chat.side_effect = None
+        client.model.start_chat.return_value = chat
+        with self.settings(ATTEMPTS_PER_MESSAGE=2, WAIT_TIME=0):
+            self.assertEqual(client.send_message("one two three"), "an answer")
+        client.rate_limiter.acquire.assert_called_once()
+        self.assertEqual(client.rate_limiter.acquire.call_args.args[0], 3)
+        client.rate_limiter.record.assert_called_once_with(2)
+
+    def test_trimming_is_linear_in_the_records_dropped(self):
+        from backend.scripts import ChatHistory
+        history = ChatHistory()
+        history.init_history(10**9)
+        for i in range(20000):
+            history.add_record("user", "message", 1)
+        history.max_tokens = 2
+        with mock.patch("builtins.sum", wraps=sum) as summed:
+            history.trim_history()
+        self.assertEqual(history.tokens, 0)
+        self.assertEqual(history.history, [])
+        self.assertLessEqual(summed.call_count, 10000)
+
+class FakeBatchModel:
+    """
+    Answers every message with a spec sheet, recording the batches and their deadlines.
+    """
+    def __init__(self):
+        self.batches = []
+        self.messages = []
+
+    def start_chat(self, prompt):
+        pass
+
+    def send_batch(self, messages, deadline=None, deadlines=None):
+        self.batches.append((list(messages), deadlines))
+        return [json.dumps({"Processor": message}) for message in messages]
+
+    def send_message(self, message, deadline=None):
+        self.messages.append(message)
+        return json.dumps({"veredict": True, "reasoning": "ok"})
+
+@override_settings(LOCAL_LLM_CONCURRENCY=8, PRODUCT_TIME_BUDGET=60, SEARCH_TIME_BUDGET=10)
+class BatchTests(TestCase):
+    """
+    Checks the batch path of the Maker, with the context lookups and LLMs faked.
+    """
+    def setUp(self):
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.search_deadlines = []
+
+    def get_product_prompt(self, product, model, llm, google_search=True, stored_context=False, deadline=None):
+        from backend.enums import SearchEnum
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.search_deadlines.append(deadline.remaining())
+        time.sleep(0.2)
+        with self.lock:
+            self.active -= 1
+        return f"context of {product}", SearchEnum.CONTEXT
+
+    def test_contexts_are_gathered_concurrently_within_the_product_budget(self):
+        from backend.enums import LLMEnum, SearchEnum
+        from backend.scripts import Deadline, generate_sheets_batch
+        products = [f"product {i}" for i in range(16)]
+        model, copywriter = FakeBatchModel(), FakeBatchModel()
+        start = time.monotonic()
+        with mock.patch("backend.scripts.get_product_prompt", self.get_product_prompt):
+            results = generate_sheets_batch(products, model, copywriter, LLMEnum.LOCAL, deadline=Deadline(1000))
+        self.assertLess(time.monotonic() - start, 16 * 0.2)
+        self.assertEqual(self.max_active, 8)
+        self.assertTrue(all(remaining <= 10 for remaining in self.search_deadlines))
+        self.assertEqual([data["Processor"] for response, data, outcome in results], [f"context of {product}" for product in products])
+        self.assertEqual({outcome for response, data, outcome in results}, {SearchEnum.CONTEXT})
+        # The Maker and the copywriter get one batch, each message bound by its product budget
+        self.assertEqual(len(model.batches), 1)
+        self.assertTrue(all(0 < deadline.remaining() <= 60 for deadline in model.batches[0][1]))
+        self.assertEqual(len(copywriter.batches[0][0]), 16)
+
+    @override_settings(LOCAL_LLM_CONCURRENCY=1)
+    def test_products_are_skipped_once_the_deadline_runs_out(self):
+        from backend.enums import LLMEnum, SearchEnum
+        from backend.scripts import Deadline, generate_sheets_batch
+        deadline = Deadline(1000)
+        def get_product_prompt(product, *args):
+            # The budget runs out during the 16th lookup, which runs one at a time
+            self.lookups += 1
+            if self.lookups == 16:
+                deadline.end = time.monotonic() - 1
+            return product, SearchEnum.CONTEXT
+        self.lookups = 0
+        model = FakeBatchModel()
+        with mock.patch("backend.scripts.get_product_prompt", get_product_prompt):
+            results = generate_sheets_batch([f"product {i}" for i in range(24)], model, FakeBatchModel(), LLMEnum.LOCAL, deadline=deadline)
+        outcomes = [outcome for response, data, outcome in results]
+        self.assertEqual(outcomes[:16], [SearchEnum.CONTEXT] * 16)
+        self.assertEqual(outcomes[16:], [SearchEnum.SKIPPED] * 8)
+        self.assertEqual(len(model.batches[0][0]), 16)
+
+    def test_run_test_batches_the_maker(self):
+        from backend.enums import LLMEnum, SearchEnum, TierEnum
+        from backend.scripts import run_test
+        category = Category.objects.create(name="Laptops")
+        for part_number in ("20XW", "82A1", "X515"):
+            GroundTruthProduct.objects.create(category=category, name=part_number, brand="Lenovo", part_number=part_number)
+        models = {LLMEnum.LOCAL: FakeBatchModel(), LLMEnum.GEMINI: FakeBatchModel(), LLMEnum.CHATGPT: FakeBatchModel()}
+        with mock.patch("backend.scripts.get_model", models.get), mock.patch("backend.scripts.get_prompt", return_value="prompt"):
+            rows = list(run_test(LLMEnum.LOCAL, LLMEnum.GEMINI, LLMEnum.CHATGPT, category.id, google_search=False))
+        self.assertEqual(len(models[LLMEnum.LOCAL].batches), 1)
+        self.assertEqual(sorted(models[LLMEnum.LOCAL].batches[0][0]), ["Lenovo 20XW", "Lenovo 82A1", "Lenovo X515"])
+        # Every spec sheet is judged one by one
+        self.assertEqual(len(models[LLMEnum.GEMINI].messages), 3)
+        self.assertEqual({(row.search, row.tier) for row in rows}, {(SearchEnum.DISABLED, TierEnum.SINGLE)})
+
+class FakeMaker:
+    """
+    Answers every message with the same response, recording the messages.
+    """
+    def __init__(self, response, max_tokens=20000):
+        self.response = response
+        self.max_tokens = max_tokens
+        self.messages = []
+
+    def start_chat(self, prompt):
+        pass
+
+    def send_message(self, message, deadline=None):
+        self.messages.append(message)
+        return self.response
+
+@override_settings(CASCADE_SCORE_THRESHOLD=80)
+class CascadeTests(SimpleTestCase):
+    """
+    Covers when the spec sheet of the cheap model of a cascade is escalated to the Maker.
+    """
+    attributes = ["Processor", "RAM"]
+    ground_truth = {"name": "X1", "Processor": "Intel i7", "RAM": "16 GB", "description": ""}
+
+    def generate_sheet(self, cheap_response, ground_truth=None):
+        from backend.enums import LLMEnum
+        from backend.scripts import generate_sheet
+        cheap_model = FakeMaker(cheap_response)
+        model = FakeMaker(json.dumps({"Processor": "Intel i7", "RAM": "16 GB"}))
+        response, data, outcome, tier = generate_sheet(
+            "Lenovo 20XW", model, FakeMaker("A laptop."), LLMEnum.CHATGPT, google_search=False,
+            cheap_model=cheap_model, attributes=self.attributes, ground_truth=ground_truth)
+        return data, tier, model
+
+    def test_complete_sheet_is_not_escalated(self):
+        from backend.enums import TierEnum
+        data, tier, model = self.generate_sheet(json.dumps({"Processor": "Intel i5", "RAM": "16 GB"}))
+        self.assertEqual((data["Processor"], tier), ("Intel i5", TierEnum.CHEAP))
+        self.assertEqual(model.messages, [])
+
+    def test_invalid_or_incomplete_sheet_is_escalated(self):
+        from backend.enums import TierEnum
+        for response in ("Sorry, I do not know this product.", json.dumps({"Processor": "Intel i5", "RAM": " "}), json.dumps({"Processor": "Intel i5"})):
+            data, tier, model = self.generate_sheet(response)
+            self.assertEqual((data["Processor"], tier), ("Intel i7", TierEnum.ESCALATED), response)
+            self.assertEqual(model.messages, ["Lenovo 20XW"])
+
+    def test_low_score_is_only_escalated_with_a_ground_truth(self):
+        from backend.enums import TierEnum
+        wrong = json.dumps({"Processor": "AMD Ryzen", "RAM": "4 GB"})
+        self.assertEqual(self.generate_sheet(wrong)[1], TierEnum.CHEAP)
+        self.assertEqual(self.generate_sheet(wrong, self.ground_truth)[1], TierEnum.ESCALATED)
+        self.assertEqual(self.generate_sheet(json.dumps({"Processor": "Intel i7", "RAM": "16 GB"}), self.ground_truth)[1], TierEnum.CHEAP)
+
+    def test_context_fits_the_smaller_token_window(self):
+        from backend.enums import LLMEnum, SearchEnum
+        from backend.scripts import generate_sheet
+        cheap_model, model = FakeMaker("not JSON", max_tokens=20000), FakeMaker("{}", max_tokens=8192)
+        search_google = mock.Mock(return_value=("<context>...</context>\nLenovo 20XW", SearchEnum.CONTEXT))
+        with mock.patch("backend.scripts.search_google", search_google):
+            generate_sheet("Lenovo 20XW", model, FakeMaker("A laptop."), LLMEnum.LOCAL, cheap_model=cheap_model, attributes=self.attributes)
+        self.assertIs(search_google.call_args.args[1], model)
+        self.assertEqual(model.messages, cheap_model.messages)
+
+@override_settings(ADAPTIVE_CONFIDENCE_THRESHOLD=0.8)
+class NeedsSearchTests(SimpleTestCase):
+    """
+    Covers when adaptive search regenerates a spec sheet with a Google search.
+    """
+    attributes = ["Processor", "RAM"]
+
+    def needs_search(self, data):
+        from backend.scripts import needs_search
+        return needs_search(data, self.attributes)
+
+    def test_confident_complete_sheet_needs_no_search(self):
+        self.assertFalse(self.needs_search({"Processor": "Intel i7", "RAM": "16 GB", "confidence": 0.9}))
+        self.assertFalse(self.needs_search({"Processor": "Intel i7", "RAM": "16 GB", "confidence": "0.8"}))
+
+    def test_invalid_sheet_needs_search(self):
+        self.assertTrue(self.needs_search(None))
+
+    def test_missing_or_empty_attributes_need_search(self):
+        self.assertTrue(self.needs_search({"Processor": "Intel i7", "confidence": 0.9}))
+        self.assertTrue(self.needs_search({"Processor": "Intel i7", "RAM": " ", "confidence": 0.9}))
+        self.assertTrue(self.needs_search({"Processor": "Intel i7", "RAM": None, "confidence": 0.9}))
+
+    def test_placeholder_values_need_search(self):
+        for placeholder in ("Unknown", "N/A", " not available ", "-", "TBD"):
+            self.assertTrue(self.needs_search({"Processor": "Intel i7", "RAM": placeholder, "confidence": 0.9}), placeholder)
+        self.assertTrue(self.needs_search({"Processor": "Intel i7", "RAM": "16 GB", "Weight": "unknown", "confidence": 0.9}))
+
+    def test_missing_invalid_or_low_confidence_needs_search(self):
+        self.assertTrue(self.needs_search({"Processor": "Intel i7", "RAM": "16 GB"}))
+        self.assertTrue(self.needs_search({"Processor": "Intel i7", "RAM": "16 GB", "confidence": "high"}))
+        self.assertTrue(self.needs_search({"Processor": "Intel i7", "RAM": "16 GB", "confidence": 0.5}))
+
+class AdminSearchTests(TestCase):
+    """
+    Checks that the admin searches products by brand and part number prefix through their indexes.
+    """
+    def setUp(self):
+        category = Category.objects.create(name="Laptops")
+        for brand, part_number in [("Lenovo", "20XW"), ("LENOVO", "82A1"), ("Dell", "LEN-1"), ("Asus", "X515")]:
+            GroundTruthProduct.objects.create(category=category, name=part_number, brand=brand, part_number=part_number)
+
+    def search(self, term):
+        from django.contrib import admin
+        queryset, _ = admin.site._registry[GroundTruthProduct].get_search_results(None, GroundTruthProduct.objects.all(), term)
+        return queryset
+
+    def test_search_matches_prefixes_ignoring_case(self):
+        for term in ("Len", "len", "LEN"):
+            self.assertEqual(set(self.search(term).values_list("part_number", flat=True)), {"20XW", "82A1", "LEN-1"}, term)
+        self.assertEqual(set(self.search("x5").values_list("part_number", flat=True)), {"X515"})
+        self.assertEqual(set(self.search("dell").values_list("part_number", flat=True)), {"LEN-1"})
+        self.assertEqual(self.search("").count(), 4)
+
+    def test_attributes_are_picked_with_an_autocomplete(self):
+        from django.contrib import admin
+        from django.contrib.admin.widgets import AutocompleteSelect
+        from django.test import RequestFactory
+        from specgenie.admin import ProductAttributeInline
+        request = RequestFactory().get("/admin/specgenie/groundtruthproduct/add/")
+        request.resolver_match = mock.Mock(kwargs={})
+        inline = ProductAttributeInline(GroundTruthProduct, admin.site)
+        field = inline.formfield_for_foreignkey(ProductAttribute._meta.get_field("attribute"), request)
+        self.assertIsInstance(field.widget, AutocompleteSelect)
+
+    def test_search_uses_the_indexes(self):
+        from django.db import connection
+        if connection.vendor != "sqlite":
+            self.skipTest("The query plan is checked on SQLite")
+        sql, params = self.search("Len").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertFalse([step for step in plan if step.startswith("SCAN")], plan)
+
+def random_words(rng, count):
+    vocabulary = [f"word{i}" for i in range(5000)]
+    return rng.choices(vocabulary, weights=[1 / (i + 1) for i in range(5000)], k=count)
+
+def change_words(rng, words, share=0.01):
+    words = list(words)
+    for i in rng.sample(range(len(words)), max(1, int(len(words) * share))):
+        words[i] = f"changed{i}"
+    return words
+
+class SimhashTests(SimpleTestCase):
+    """
+    Checks that pages with a few words changed are near-duplicates, and unrelated pages are not.
+    """
+    def test_pages_with_one_percent_of_words_changed_are_near_duplicates(self):
+        from backend.scripts import is_near_duplicate, simhash
+        rng = random.Random(0)
+        for count in (300, 1000, 3000):
+            for _ in range(10):
+                words = random_words(rng, count)
+                fingerprint = simhash(" ".join(words))
+                self.assertTrue(is_near_duplicate(simhash(" ".join(change_words(rng, words))), [fingerprint]))
+                self.assertFalse(is_near_duplicate(simhash(" ".join(random_words(rng, count))), [fingerprint]))
+
+    def test_simhash_ignores_case_and_punctuation(self):
+        from backend.scripts import simhash
+        self.assertEqual(simhash("Intel Core i7, 16 GB RAM."), simhash("intel core i7 16 gb ram"))
+
+class PageHandler(BaseHTTPRequestHandler):
+    """
+    Serves the pages of the search results, with `/flaky` failing with a 503 status the first time it is requested.
+    """
+    pages = {}
+    requested = []
+    failed = False
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requested.append(self.path)
+        if self.path == "/flaky" and not cls.failed:
+            cls.failed = True
+            self.send_response(503)
+            self.end_headers()
+            return
+        content_type, content = self.pages[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeModel:
+    max_tokens = 1000
+
+    def __init__(self):
+        self.counted = []
+
+    def count_tokens(self, prompt, deadline=None):
+        self.counted.append(prompt)
+        return len(prompt) // 8
+
+@override_settings(FETCH_CHARS_PER_TOKEN=8, FINGERPRINT_CHARS=4000, SEARCH_MAX_PAGES=1)
+class UselessPageTests(TestCase):
+    """
+    Runs Google searches against local pages, with the Custom Search API mocked.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = random.Random(0)
+        words = random_words(rng, 4000)
+        cls.flaky_text = " ".join(random_words(rng, 300))
+        html = lambda words: f"<html><body><p>{' '.join(words)}</p></body></html>".encode()
+        PageHandler.pages = {
+            "/flaky": ("text/html", html(cls.flaky_text.split())),
+            "/manual.pdf": ("application/pdf", b"%PDF-1.4"),
+            "/long": ("text/html; charset=utf-8", html(words)),
+            # The start of the long page, on another site
+            "/mirror": ("text/html", html(change_words(rng, words[:900]))),
+            "/short": ("text/html", html(random_words(rng, 300))),
+        }
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        PageHandler.requested = []
+        PageHandler.failed = False
+
+    def search(self, model):
+        import requests
+        from backend.scripts import search_google
+        get = requests.get
+        urls = [f"http://127.0.0.1:{self.server.server_port}{path}" for path in PageHandler.pages]
+        def fake_get(url, **kwargs):
+            if url.startswith("https://customsearch.googleapis.com/"):
+                return mock.Mock(json=lambda: {"items": [{"link": url} for url in urls]})
+            return get(url, **kwargs)
+        with mock.patch("requests.get", fake_get):
+            return search_google("Lenovo 20XW", model)
+
+    def test_useless_pages_are_marked_and_not_fetched_again(self):
+        from backend.enums import SearchEnum
+        model = FakeModel()
+        prompt, outcome = self.search(model)
+        self.assertEqual(outcome, SearchEnum.CONTEXT)
+        self.assertEqual(PageHandler.requested, ["/flaky", "/manual.pdf", "/long", "/mirror", "/short"])
+        reasons = {page.url.rsplit("/", 1)[1]: page for page in UselessPage.objects.all()}
+        self.assertEqual({url: page.reason for url, page in reasons.items()}, {
+            "manual.pdf": "not_html", "long": "too_long", "mirror": "duplicate"})
+        self.assertTrue(reasons["long"].fingerprint)
+        self.assertGreater(reasons["manual.pdf"].max_tokens, model.max_tokens)
+        self.assertEqual(reasons["long"].max_tokens, model.max_tokens)
+        # Only the page that was used had its tokens counted
+        self.assertEqual(len(model.counted), 1)
+        self.assertEqual(prompt, model.counted[0])
+
+        # The page that failed with a 503 status is tried again, and the useless ones are not
+        PageHandler.requested = []
+        prompt, outcome = self.search(FakeModel())
+        self.assertEqual(outcome, SearchEnum.CONTEXT)
+        self.assertEqual(PageHandler.requested, ["/flaky"])
+        self.assertIn(self.flaky_text, prompt)
+        self.assertFalse(UselessPage.objects.filter(url__endswith="/flaky").exists())
+        self.assertTrue(FetchedPage.objects.filter(url__endswith="/flaky").exists())
+
+    def test_cached_page_over_the_limit_is_marked_too_long(self):
+        from backend.scripts import PageRejected, fetch_cached_page
+        url = f"http://127.0.0.1:{self.server.server_port}/mirror"
+        text, fingerprint = fetch_cached_page(url, 100000)
+        with self.assertRaises(PageRejected) as raised:
+            fetch_cached_page(url, 1000)
+        self.assertEqual(raised.exception.reason, "too_long")
+        self.assertEqual(raised.exception.text, text)
+        self.assertEqual(PageHandler.requested, ["/mirror"])